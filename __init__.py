@@ -94,6 +94,9 @@ def load_handler(dummy):
     # convert image output file type setting from blender to yafaray's file type setting on file load, so that both are the same...
     if bpy.context.scene.render.image_settings.file_format is not bpy.context.scene.img_output:
         bpy.context.scene.img_output = bpy.context.scene.render.image_settings.file_format
+    # the scenes kept for incremental export and previews belong to the last file
+    io.yaf_session.endSession()
+    io.yaf_session.clearPreviewPool()
 
 
 def register():
@@ -117,6 +120,8 @@ def unregister():
             kma.keymap_items.remove(kmi)
     bpy.utils.unregister_module(__name__)
     bpy.app.handlers.load_post.remove(load_handler)
+    io.yaf_session.endSession()
+    io.yaf_session.clearPreviewPool()
 
 
 if __name__ == '__main__':
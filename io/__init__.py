@@ -26,3 +26,14 @@ from . import yaf_texture
 from . import yaf_object
 from . import yaf_light
 from . import yaf_material
+from . import yaf_geometry
+from . import yaf_view
+from . import yaf_stats
+from . import yaf_session
+from . import yaf_framebuffer
+from . import yaf_imagefile
+from . import yaf_index
+from . import yaf_shadergraph
+from . import yaf_params
+from . import yaf_imagecache
+from . import yaf_proxy
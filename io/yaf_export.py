@@ -20,9 +20,11 @@
 
 #TODO: Use Blender enumerators if any
 import bpy
+import collections
 import os
 import threading
 import time
+import mathutils
 import yafrayinterface
 from yafaray import PLUGIN_PATH
 from yafaray import YAF_ID_NAME
@@ -31,8 +33,20 @@ from .yaf_light  import yafLight
 from .yaf_world  import yafWorld
 from .yaf_integrator import yafIntegrator
 from . import yaf_scene
+from . import yaf_geometry
+from . import yaf_stats
+from . import yaf_session
+from . import yaf_imagefile
+from . import yaf_texture
+from . import yaf_imagecache
+from . import yaf_proxy
 from .yaf_texture import yafTexture
 from .yaf_material import yafMaterial
+from .yaf_framebuffer import yafFramebufferRelay
+from .yaf_index import yafExportIndex
+
+# how often a running render looks for user aborts, in seconds
+ABORT_CHECK_INTERVAL = 0.02
 
 
 class YafaRayRenderEngine(bpy.types.RenderEngine):
@@ -48,6 +62,11 @@ class YafaRayRenderEngine(bpy.types.RenderEngine):
         self.materialMap = {}
         self.materials = set()
         self.yi = yi
+        self.stats = yaf_stats.yafExportStats(self.scene.frame_current)
+
+        if not self.is_preview and self.scene.gs_export_stats:
+            # count the interface calls of the export
+            self.yi = self.stats.wrapInterface(yi)
 
         if self.is_preview:
             self.yi.setVerbosityMute()
@@ -56,125 +75,386 @@ class YafaRayRenderEngine(bpy.types.RenderEngine):
         else:
             self.yi.setVerbosityMute()
 
-        self.yi.loadPlugins(PLUGIN_PATH)
-        self.yaf_object = yafObject(self.yi, self.materialMap)
+        if self.session is None or self.session.frames == 1:
+            self.yi.loadPlugins(PLUGIN_PATH)
+        self.yaf_object = yafObject(self.yi, self.materialMap, self.getGeometryCache(), self.stats, self.session)
         self.yaf_lamp = yafLight(self.yi, self.is_preview)
         self.yaf_world = yafWorld(self.yi)
         self.yaf_integrator = yafIntegrator(self.yi)
         self.yaf_texture = yafTexture(self.yi)
         self.yaf_material = yafMaterial(self.yi, self.materialMap, self.yaf_texture.loadedTextures)
+        self.yaf_object.textureMap = self.yaf_texture.loadedTextures
 
-    def exportScene(self):
-        for obj in self.scene.objects:
-            self.exportTexture(obj)
-        self.exportMaterials()
-        self.yaf_object.setScene(self.scene)
-        self.exportObjects()
-        self.yaf_object.createCamera()
-        self.yaf_world.exportWorld(self.scene)
-
-    def exportTexture(self, obj):
-        # First export the textures of the materials type 'blend'
-        for mat_slot in [m for m in obj.material_slots if m.material is not None]:
-            if mat_slot.material.mat_type == 'blend':
-                try:
-                    mat1 = bpy.data.materials[mat_slot.material.material1]
-                    mat2 = bpy.data.materials[mat_slot.material.material2]
-                except:
-                    self.yi.printWarning("Exporter: Problem with blend material {0}. Could not find one of the two blended materials".format(mat_slot.material.name))
-                    continue
-                for bm in [mat1, mat2]:
-                    for blendtex in [bt for bt in bm.texture_slots if (bt and bt.texture and bt.use)]:
-                        if self.is_preview and blendtex.texture.name == 'fakeshadow':
-                            continue
-                        self.yaf_texture.writeTexture(self.scene, blendtex.texture)
-            else:
-                continue
+    def getInterface(self, newSession=False):
+        # with a persistent session the interface and the scene stay alive
+        # over the frames of an animation, with incremental export between
+        # still renders, only the changes are exported. Previews keep their
+        # scene in a pool of warm interfaces
+        lastSession = getattr(self, "session", None)
+        self.session = None
 
-        for mat_slot in [m for m in obj.material_slots if m.material is not None]:
-            for tex in [t for t in mat_slot.material.texture_slots if (t and t.texture and t.use)]:
-                if self.is_preview and tex.texture.name == "fakeshadow":
-                    continue
-                self.yaf_texture.writeTexture(self.scene, tex.texture)
+        if self.is_preview:
+            if lastSession is not None:
+                # the pooled scene couldn't take the changes
+                lastSession.close()
+            if not getattr(bpy.context.scene, "gs_preview_session", True):
+                return yafrayinterface.yafrayInterface_t()
+            self.session = yaf_session.acquirePreviewSession(yafrayinterface.yafrayInterface_t, newSession)
+            self.session.beginFrame()
+            return self.session.interface()
+
+        if getattr(self, "is_animation", False):
+            if not self.scene.gs_persistent_session:
+                yaf_session.endSession()
+                return yafrayinterface.yafrayInterface_t()
+            newSession = newSession or self.scene.frame_current == self.scene.frame_start
+
+        elif not self.scene.gs_incremental_export:
+            yaf_session.endSession()
+            return yafrayinterface.yafrayInterface_t()
+
+        self.session = yaf_session.getSession(yafrayinterface.yafrayInterface_t, self.scene.name, newSession)
+        self.session.beginFrame()
+        return self.session.interface()
+
+    def getGeometryCache(self):
+        cache = yaf_geometry.geometryCache
+        # geometry can only be reused between the frames of an animation
+        if self.is_preview or not self.scene.gs_geometry_cache or not getattr(self, "is_animation", False):
+            cache.clear()
+            return None
+        if self.scene.frame_current == self.scene.frame_start:
+            cache.clear()
+        cache.beginFrame()
+        return cache
+
+    def getImageCache(self):
+        scene = self.scene
+        if not scene.gs_image_cache:
+            return None
+        try:
+            cache = yaf_imagecache.yafImageCache(scene.gs_image_cache_dir, scene.gs_image_cache_size * 1048576)
+        except OSError as e:
+            self.yi.printWarning("Exporter: Image cache not available: {0}".format(e))
+            return None
+        return cache
+
+    def getTextureProxies(self):
+        # final renders keep the original images unless they choose a proxy level,
+        # the settings of previews are taken from the scene being edited
+        scene = bpy.context.scene if self.is_preview else self.scene
+        if self.is_preview or scene.gs_clay_render:
+            maxSize = int(scene.gs_preview_proxy)
+        else:
+            maxSize = int(scene.gs_texture_proxy)
+        if not maxSize:
+            return None
+        try:
+            return yaf_proxy.yafTextureProxies(scene.gs_image_cache_dir, maxSize)
+        except OSError as e:
+            self.yi.printWarning("Exporter: Texture proxies not available: {0}".format(e))
+            return None
 
-    def object_on_visible_layer(self, obj):
-        obj_visible = False
-        for layer_visible in [object_layers and scene_layers for object_layers, scene_layers in zip(obj.layers, self.scene.layers)]:
-            obj_visible |= layer_visible
-        return obj_visible
+    def exportScene(self):
+        self.yaf_texture.imageCache = self.getImageCache()
+        proxies = self.getTextureProxies()
+        self.yaf_texture.proxies = proxies
+        self.yaf_world.proxies = proxies
+        with self.stats.phase("materials"):
+            self.exportMaterials()
+        self.yaf_object.setScene(self.scene)
+        self.yaf_material.setScene(self.scene)
+        # the camera is needed by the level of detail estimations of the geometry export
+        with self.stats.phase("camera"):
+            self.yaf_object.createCamera()
+        if self.session is not None:
+            # find out before the objects are exported whether the scene of the last frame can take the changes
+            reason = self.session.layoutChanged(*self.sceneLayout())
+            if reason is not None:
+                raise yaf_session.yafSessionRebuild(reason)
+        with self.stats.phase("objects"):
+            self.exportObjects()
+        self.stats.counters["materials"] = len(self.index.materials)
+        self.stats.counters["textures"] = len(self.index.textures)
+        self.stats.counters["shared materials"] = self.yaf_material.sharedMaterials
+        self.stats.counters["shared textures"] = self.yaf_texture.sharedTextures
+        imageCache = self.yaf_texture.imageCache
+        if imageCache is not None:
+            summary = imageCache.summary()
+            self.yi.printInfo("Exporter: {0}".format(summary))
+            imageCache.finish()
+        if self.scene.gs_clay_render:
+            self.reportClaySavings()
+        else:
+            yaf_stats.materialTimes[self.scene.name] = self.stats.phases.get("materials", 0.0)
+        with self.stats.phase("world"):
+            self.yaf_world.exportWorld(self.scene)
+        if proxies is not None:
+            self.stats.counters["texture proxies"] = proxies.used
+            summary = "Texture proxies: {0:d} images at most {1:d} pixels, {2:d} without a proxy".format(proxies.used, proxies.maxSize, proxies.missing)
+            self.yi.printInfo("Exporter: {0}".format(summary))
+
+        strandStats = self.yaf_object.strandStats
+        if strandStats:
+            summary = "Hair: {0:d} systems, {1:d} strands, {2:d} keys in {3:.3f}s".format(
+                len(strandStats), sum(s[2] for s in strandStats), sum(s[3] for s in strandStats), sum(s[4] for s in strandStats))
+            self.yi.printInfo("Exporter: {0}".format(summary))
+            self.reportStatus(summary)
+
+        if self.yaf_object.culledInstances:
+            self.stats.counters["culled"] = self.yaf_object.culledInstances
+            summary = "Culling: {0:d} objects and instances outside the camera view".format(self.yaf_object.culledInstances)
+            self.yi.printInfo("Exporter: {0}".format(summary))
+            self.reportStatus(summary)
+
+        cache = self.yaf_object.geometryCache
+        if cache is not None:
+            cache.endFrame()
+            self.stats.counters["geometry cache hits"] = cache.hits
+            self.stats.counters["geometry cache misses"] = cache.misses
+            summary = "Geometry cache: {0} hits, {1} misses".format(cache.hits, cache.misses)
+            self.yi.printInfo("Exporter: {0}".format(summary))
+            self.reportStatus(summary)
+
+    def sceneLayout(self):
+        # The state of what a session can't update in place: lights and volume
+        # regions can't be replaced, instances can't be moved, objects can't
+        # be removed. Returns the states by object name and the names of the
+        # objects whose duplis or particles changed
+        scene = self.scene
+        yaf_object = self.yaf_object
+        layout = {}
+        changed = []
+
+        def matrixValues(matrix):
+            return tuple(tuple(row) for row in matrix)
+
+        def settings(obj, prefix):
+            return [(p.identifier, getattr(obj, p.identifier)) for p in obj.bl_rna.properties if p.identifier.startswith(prefix)]
+
+        for obj in self.index.lamps:
+            layout[obj.name] = (matrixValues(obj.matrix_world), yaf_geometry.rnaSignature(obj.data, False))
+
+        instanced = False
+        for obj in self.index.geometry:
+            state = None
+            if obj.is_duplicator or obj.particle_systems:
+                # the instances follow the object and its data
+                state = matrixValues(obj.matrix_world)
+                instanced = True
+                if self.session.isDirty(obj):
+                    changed.append(obj.name)
+            elif obj.type == 'EMPTY':
+                pass
+            elif obj.vol_enable:
+                state = (matrixValues(obj.matrix_world), [tuple(c) for c in obj.bound_box], settings(obj, "vol_"))
+            elif obj.ml_enable:
+                state = settings(obj, "ml_")
+            elif obj.bgp_enable:
+                state = settings(obj, "bgp_")
+            elif (obj.data.users > 1 and scene.render.use_instances) or scene.gs_auto_instancing:
+                state = matrixValues(obj.matrix_world)
+                instanced = True
+            elif scene.gs_cull_geometry:
+                # moving objects are uploaded again, only leaving the view removes them
+                state = yaf_object.isCulled(obj)
+            layout[obj.name] = state
+
+        # the camera splits the instances by culling and level of detail
+        if instanced and (scene.gs_cull_geometry or scene.gs_lod) and scene.camera is not None:
+            layout[""] = (matrixValues(scene.camera.matrix_world), yaf_geometry.rnaSignature(scene.camera.data, False))
+
+        return layout, changed
+
+    def exportObjectMaterials(self, obj):
+        # materials and the textures they need are created when the first
+        # exported object uses them
+        if self.scene.gs_clay_render:
+            # everything gets the clay material, only note what it stands in for
+            for mat_slot in obj.material_slots:
+                self.index.addMaterial(mat_slot.material)
+            # the density of noise volumes still comes from the texture of their material
+            if obj.vol_enable and obj.vol_region == 'Noise Volume' and obj.active_material and obj.active_material.active_texture:
+                with self.stats.phase("materials"):
+                    self.yaf_texture.writeTexture(self.scene, obj.active_material.active_texture)
+            return
+
+        materials = [ms.material for ms in obj.material_slots if ms.material is not None and ms.material not in self.materials]
+        if not materials:
+            return
+
+        with self.stats.phase("materials"):
+            textures = [self.index.addMaterial(material) for material in materials]
+            imageCache = self.yaf_texture.imageCache
+            if imageCache is not None:
+                # the packed images of the new textures are extracted together
+                imageCache.prefetch([tex.image for texs in textures for tex in texs if getattr(tex, "image", None) is not None])
+            for material, texs in zip(materials, textures):
+                for tex in texs:
+                    self.yaf_texture.writeTexture(self.scene, tex)
+                if material not in self.materials:
+                    self.exportMaterial(material)
+
+    def reportClaySavings(self):
+        images = {}
+        for tex in self.index.textures:
+            image = getattr(tex, "image", None)
+            if image is not None:
+                images[image.name] = image
+        imageBytes = sum(yaf_texture.imageMemory(image) for image in images.values())
+
+        summary = "Clay render: skipped {0:d} materials, {1:d} textures, {2:.1f} MB of images".format(
+            len(self.index.materials), len(self.index.textures), imageBytes / 1048576.0)
+        seconds = yaf_stats.materialTimes.get(self.scene.name)
+        if seconds is not None:
+            summary += ", {0:.2f}s of material export".format(seconds)
+        self.stats.counters["clay image bytes"] = imageBytes
+        self.yi.printInfo("Exporter: {0}".format(summary))
+        self.reportStatus(summary)
+
+    def exportParticleInstances(self, pSys, dupBaseIds):
+        dupli = pSys.settings.dupli_object
+        if dupli is None or dupli.type == 'EMPTY':
+            return
+
+        matrices = self.yaf_object.cullInstances(dupli, self.yaf_object.getParticleInstanceMatrices(pSys))
+        if not len(matrices):
+            return
+
+        self.exportObjectMaterials(dupli)
+
+        if not self.scene.render.use_instances:
+            for matrix in matrices:
+                self.yaf_object.writeMesh(dupli, mathutils.Matrix(matrix.tolist()))
+        else:
+            self.yaf_object.writeInstancesLod(dupBaseIds, dupli.name, dupli, matrices)
 
     def exportObjects(self):
         self.yi.printInfo("Exporter: Processing Lamps...")
 
-        # export only visible lamps
-        for obj in [o for o in self.scene.objects if not o.hide_render and o.is_visible(self.scene) and o.type == 'LAMP']:
-            if obj.is_duplicator:
-                obj.create_dupli_list(self.scene)
-                for obj_dupli in obj.dupli_list:
-                    matrix = obj_dupli.matrix.copy()
-                    self.yaf_lamp.createLight(self.yi, obj_dupli.object, matrix)
+        with self.stats.phase("lights"):
+            # export only visible lamps
+            for obj in self.index.lamps:
+                if obj.is_duplicator:
+                    obj.create_dupli_list(self.scene)
+                    for obj_dupli in obj.dupli_list:
+                        matrix = obj_dupli.matrix.copy()
+                        self.yaf_lamp.createLight(self.yi, obj_dupli.object, matrix)
 
-                if obj.dupli_list:
-                    obj.free_dupli_list()
-            else:
-                if obj.parent and obj.parent.is_duplicator:
-                    continue
-                self.yaf_lamp.createLight(self.yi, obj, obj.matrix_world)
+                    if obj.dupli_list:
+                        obj.free_dupli_list()
+                else:
+                    if obj.parent and obj.parent.is_duplicator:
+                        continue
+                    self.yaf_lamp.createLight(self.yi, obj, obj.matrix_world)
 
         self.yi.printInfo("Exporter: Processing Geometry...")
 
-        # export only visible objects
         baseIds = {}
         dupBaseIds = {}
+        autoInstances = []
+        # mesh data name -> (first object, matrices) of the objects sharing the data
+        sharedInstances = collections.OrderedDict()
+
+        for obj in self.index.geometry:
+            with self.stats.object(obj.name):
+                self.exportObject(obj, baseIds, dupBaseIds, autoInstances, sharedInstances)
 
-        for obj in [o for o in self.scene.objects if not o.hide_render and (o.is_visible(self.scene) or o.hide) \
-        and self.object_on_visible_layer(o) and (o.type in {'MESH', 'SURFACE', 'CURVE', 'FONT', 'EMPTY'})]:
-            # Exporting dupliObjects as instances, also check for dupliObject type 'EMPTY' and don't export them as geometry
-            if obj.is_duplicator:
-                self.yi.printInfo("Processing duplis for: {0}".format(obj.name))
+        # one base and one batch of instances per shared mesh data
+        for dataName, (obj, matrices) in sharedInstances.items():
+            self.yi.printInfo("Processing shared mesh data: {0}, {1:d} objects".format(dataName, len(matrices)))
+            with self.stats.object(obj.name):
+                self.yaf_object.writeInstancesLod(baseIds, dataName, obj, matrices)
+
+        if autoInstances:
+            self.yaf_object.writeAutoInstances(autoInstances)
+
+    def startRender(self, *args):
+        # runs yi.render() on a thread, the returned event is set when it ends
+        done = threading.Event()
+
+        def renderThread():
+            try:
+                self.yi.render(*args)
+            finally:
+                done.set()
+
+        t = threading.Thread(target=renderThread)
+        t.start()
+        return t, done
+
+    def waitForRender(self, done):
+        # Wait for the render thread to signal its end, looking for user
+        # aborts every few milliseconds. Returns False on abort
+        while not done.wait(ABORT_CHECK_INTERVAL):
+            if self.test_break():
+                return False
+            if self.relay is not None:
+                self.relay.flush()
+        return True
+
+    def exportObject(self, obj, baseIds, dupBaseIds, autoInstances, sharedInstances):
+        # Exporting dupliObjects as instances, also check for dupliObject type 'EMPTY' and don't export them as geometry
+        if obj.is_duplicator:
+            self.yi.printInfo("Processing duplis for: {0}".format(obj.name))
+            directSystems = yaf_geometry.getDirectParticleSystems(obj) if yaf_geometry.numpy else None
+
+            if directSystems is not None:
+                # emitter particles duplicating single objects, build the instances straight from the particle data
+                for pSys in directSystems:
+                    self.exportParticleInstances(pSys, dupBaseIds)
+            else:
                 obj.dupli_list_create(self.scene)
+                dupliInstances = collections.OrderedDict()
 
                 for obj_dupli in [od for od in obj.dupli_list if not od.object.type == 'EMPTY']:
-                    self.exportTexture(obj_dupli.object)
-                    for mat_slot in obj_dupli.object.material_slots:
-                        if mat_slot.material not in self.materials:
-                            self.exportMaterial(mat_slot.material)
+                    if self.yaf_object.isCulled(obj_dupli.object, obj_dupli.matrix):
+                        continue
+                    self.exportObjectMaterials(obj_dupli.object)
 
                     if not self.scene.render.use_instances:
                         matrix = obj_dupli.matrix.copy()
                         self.yaf_object.writeMesh(obj_dupli.object, matrix)
                     else:
-                        if obj_dupli.object.name not in dupBaseIds:
-                            dupBaseIds[obj_dupli.object.name] = self.yaf_object.writeInstanceBase(obj_dupli.object)
-                        matrix = obj_dupli.matrix.copy()
-                        self.yaf_object.writeInstance(dupBaseIds[obj_dupli.object.name], matrix, obj_dupli.object.name)
+                        dupliInstances.setdefault(obj_dupli.object.name, (obj_dupli.object, []))[1].append(obj_dupli.matrix.copy())
+
+                # submit the instances per base object
+                for name, (dupliObj, matrices) in dupliInstances.items():
+                    self.yaf_object.writeInstancesLod(dupBaseIds, name, dupliObj, matrices)
 
                 if obj.dupli_list is not None:
                     obj.dupli_list_clear()
 
-                # check if object has particle system and uses the option for 'render emitter'
-                if hasattr(obj, 'particle_systems'):
-                    for pSys in obj.particle_systems:
-                        check_rendertype = pSys.settings.render_type in {'OBJECT', 'GROUP'}
-                        if check_rendertype and pSys.settings.use_render_emitter:
-                            matrix = obj.matrix_world.copy()
-                            self.yaf_object.writeMesh(obj, matrix)
-
-            # no need to write empty object from here on, so continue with next object in loop
-            elif obj.type == 'EMPTY':
-                continue
-
-            # Exporting objects with shared mesh data blocks as instances
-            elif obj.data.users > 1 and self.scene.render.use_instances:
-                self.yi.printInfo("Processing shared mesh data node object: {0}".format(obj.name))
-                if obj.data.name not in baseIds:
-                    baseIds[obj.data.name] = self.yaf_object.writeInstanceBase(obj)
-
-                if obj.name not in dupBaseIds:
-                    matrix = obj.matrix_world.copy()
-                    self.yaf_object.writeInstance(baseIds[obj.data.name], matrix, obj.data.name)
-
-            elif obj.data.name not in baseIds and obj.name not in dupBaseIds:
+            # check if object has particle system and uses the option for 'render emitter'
+            if hasattr(obj, 'particle_systems'):
+                for pSys in obj.particle_systems:
+                    check_rendertype = pSys.settings.render_type in {'OBJECT', 'GROUP'}
+                    if check_rendertype and pSys.settings.use_render_emitter and not self.yaf_object.isCulled(obj):
+                        self.exportObjectMaterials(obj)
+                        matrix = obj.matrix_world.copy()
+                        self.yaf_object.writeMesh(obj, matrix)
+            return
+
+        # no need to write empty object from here on
+        if obj.type == 'EMPTY':
+            return
+
+        # skip geometry outside of the camera view
+        if self.yaf_object.isPlainMesh(obj) and self.yaf_object.isCulled(obj):
+            return
+
+        self.exportObjectMaterials(obj)
+
+        # Exporting objects with shared mesh data blocks as instances
+        if obj.data.users > 1 and self.scene.render.use_instances:
+            if obj.name not in dupBaseIds:
+                sharedInstances.setdefault(obj.data.name, (obj, []))[1].append(obj.matrix_world.copy())
+
+        elif obj.data.name not in baseIds and obj.name not in dupBaseIds:
+            if self.scene.gs_auto_instancing and self.yaf_object.isPlainMesh(obj):
+                # collect meshes to find the ones with identical content
+                autoInstances.append(obj)
+            else:
                 self.yaf_object.writeObject(obj)
 
     def handleBlendMat(self, mat):
@@ -225,11 +505,6 @@ class YafaRayRenderEngine(bpy.types.RenderEngine):
         cmat = self.yi.createMaterial("clayMat")
         self.materialMap["clay"] = cmat
 
-        for obj in self.scene.objects:
-            for mat_slot in obj.material_slots:
-                if mat_slot.material not in self.materials:
-                    self.exportMaterial(mat_slot.material)
-
     def exportMaterial(self, material):
         if material:
             if material.mat_type == 'blend':
@@ -270,6 +545,8 @@ class YafaRayRenderEngine(bpy.types.RenderEngine):
 
     # callback to export the scene
     def update(self, data, scene):
+        updateStart = time.time()
+        self.statusLines = []
         self.update_stats("", "Setting up render")
         if not self.is_preview:
             scene.frame_set(scene.frame_current)
@@ -281,7 +558,10 @@ class YafaRayRenderEngine(bpy.types.RenderEngine):
         fp = os.path.realpath(fp)
         fp = os.path.normpath(fp)
 
-        [self.sizeX, self.sizeY, self.bStartX, self.bStartY, self.bsizeX, self.bsizeY, camDummy] = yaf_scene.getRenderCoords(scene)
+        # everything the export stages need from the objects of the scene
+        self.index = yafExportIndex(scene, self.is_preview)
+
+        [self.sizeX, self.sizeY, self.bStartX, self.bStartY, self.bsizeX, self.bsizeY, camDummy] = yaf_scene.getRenderCoords(scene, self.index)
 
         if render.use_border:
             self.resX = self.bsizeX
@@ -290,20 +570,69 @@ class YafaRayRenderEngine(bpy.types.RenderEngine):
             self.resX = self.sizeX
             self.resY = self.sizeY
 
+        try:
+            try:
+                self.exportFrame(scene, fp)
+            except yaf_session.yafSessionRebuild as e:
+                # the changes can't be applied to the scene of the last frame,
+                # the frame is exported again into a new one
+                discarded = time.time() - updateStart
+                self.statusLines = []
+                self.exportFrame(scene, fp, True)
+                self.stats.counters["session rebuilds"] = 1
+                self.stats.addTime(self.stats.phases, "discarded export", discarded)
+                summary = "Session: rebuilt, {0}, {1:.2f}s of export discarded".format(e, discarded)
+                self.yi.printWarning("Exporter: {0}".format(summary))
+                self.reportStatus(summary)
+        except BaseException:
+            self.discardSession()
+            raise
+
+        if self.session is not None:
+            summary = "Session: " + ", ".join("{0} {1:d}".format(k, v) for k, v in sorted(self.session.updates.items()))
+            self.yi.printInfo("Exporter: {0}".format(summary))
+            self.reportStatus(summary)
+
+        if not self.is_preview and scene.gs_export_stats:
+            self.stats.addTime(self.stats.phases, "total", time.time() - updateStart)
+            self.writeExportStats(fp)
+
+    def discardSession(self):
+        # a scene left half exported or half rendered can't be used again
+        if self.session is None:
+            return
+        if self.is_preview:
+            self.session.close()
+        else:
+            yaf_session.endSession()
+        self.session = None
+
+    def reportStatus(self, summary):
+        # the summaries of the export share the one status line
+        self.statusLines.append(summary)
+        self.update_stats("", " | ".join(self.statusLines))
+
+    def exportFrame(self, scene, fp, newSession=False):
+        render = scene.render
+        self.memoryOutput = False
+
         if scene.gs_type_render == "file":
-            self.setInterface(yafrayinterface.yafrayInterface_t())
+            self.setInterface(self.getInterface(newSession))
             self.yi.setInputGamma(scene.gs_gamma_input, True)
             self.outputFile, self.output, self.file_type = self.decideOutputFileName(fp, scene.img_output)
-            self.yi.paramsClearAll()
-            self.yi.paramsSetString("type", self.file_type)
-            self.yi.paramsSetBool("alpha_channel", render.image_settings.color_mode == "RGBA")
-            self.yi.paramsSetBool("z_channel", scene.gs_z_channel)
-            self.yi.paramsSetInt("width", self.resX)
-            self.yi.paramsSetInt("height", self.resY)
-            self.ih = self.yi.createImageHandler("outFile")
-            self.co = yafrayinterface.imageOutput_t(self.ih, str(self.outputFile), 0, 0)
+            self.memoryOutput = self.useMemoryOutput(scene)
+            if not self.memoryOutput:
+                self.yi.paramsClearAll()
+                self.yi.paramsSetString("type", self.file_type)
+                self.yi.paramsSetBool("alpha_channel", render.image_settings.color_mode == "RGBA")
+                self.yi.paramsSetBool("z_channel", scene.gs_z_channel)
+                self.yi.paramsSetInt("width", self.resX)
+                self.yi.paramsSetInt("height", self.resY)
+                self.ih = self.yi.createImageHandler("outFile")
+                self.co = yafrayinterface.imageOutput_t(self.ih, str(self.outputFile), 0, 0)
 
         elif scene.gs_type_render == "xml":
+            self.session = None
             self.setInterface(yafrayinterface.xmlInterface_t())
             self.yi.setInputGamma(scene.gs_gamma_input, True)
             self.outputFile, self.output, self.file_type = self.decideOutputFileName(fp, 'XML')
@@ -312,22 +641,79 @@ class YafaRayRenderEngine(bpy.types.RenderEngine):
             self.yi.setOutfile(self.outputFile)
 
         else:
-            self.setInterface(yafrayinterface.yafrayInterface_t())
+            self.setInterface(self.getInterface(newSession))
             self.yi.setInputGamma(scene.gs_gamma_input, True)
 
-        self.yi.startScene()
-        self.exportScene()
-        self.yaf_integrator.exportIntegrator(self.scene)
-        self.yaf_integrator.exportVolumeIntegrator(self.scene)
+        if self.session is None or self.session.frames == 1:
+            self.yi.startScene()
+        with self.stats.phase("scene"):
+            self.exportScene()
+        with self.stats.phase("integrator"):
+            self.yaf_integrator.exportIntegrator(self.scene)
+            self.yaf_integrator.exportVolumeIntegrator(self.scene)
 
         # must be called last as the params from here will be used by render()
-        yaf_scene.exportRenderSettings(self.yi, self.scene)
+        yaf_scene.exportRenderSettings(self.yi, self.scene, self.index)
+
+        if self.session is not None:
+            self.session.endFrame()
+
+    def useMemoryOutput(self, scene):
+        # the render callbacks only pass the colors, the z-buffer and EXR files still need the image handler
+        return scene.gs_memory_output and not scene.gs_z_channel and yaf_imagefile.canEncode(self.file_type)
+
+    def writeOutputFile(self, scene):
+        # the buffer of the relay holds the final image, it is written while the next frame exports
+        path = self.outputFile
+        alpha = scene.render.image_settings.color_mode == "RGBA"
+        self.yi.printInfo("Exporter: Writing {0} in the background".format(path))
+
+        def written(future):
+            if future.exception() is not None:
+                print("Exporter: Could not write the image {0}: {1}".format(path, future.exception()))
+
+        yaf_imagefile.writeImageAsync(path, self.file_type, self.relay.buffer, alpha).add_done_callback(written)
+
+    def writeExportStats(self, fp):
+        summary = self.stats.summary()
+        self.yi.printInfo("Exporter: {0}".format(summary))
+        self.reportStatus(summary)
+
+        # the report goes next to the rendered images
+        folder = fp if os.path.isdir(fp) else os.path.dirname(fp)
+        self.reportPath = os.path.join(folder, "yafaray_export_{0:04d}.json".format(self.scene.frame_current))
+        self.writeReport()
+
+    def writeReport(self):
+        path = self.reportPath
+        try:
+            self.stats.writeReport(path)
+            self.yi.printInfo("Exporter: Export report written to {0}".format(path))
+        except (IOError, OSError) as e:
+            self.yi.printWarning("Exporter: Could not write the export report {0}: {1}".format(path, e))
+
+    def writeRenderStats(self):
+        summary = self.stats.renderSummary()
+        self.yi.printInfo("Exporter: {0}".format(summary))
+        if getattr(self, "reportPath", None):
+            # add the render times to the report of the export
+            self.writeReport()
 
     # callback to render scene
     def render(self, scene):
+        try:
+            self.renderFrame(scene)
+        except BaseException:
+            self.discardSession()
+            raise
+
+    def renderFrame(self, scene):
         self.bl_use_postprocess = False
+        self.relay = None
+        metrics = self.stats.render
+        renderStart = time.time()
 
-        if scene.gs_type_render == "file":
+        if scene.gs_type_render == "file" and not self.memoryOutput:
             self.yi.printInfo("Exporter: Rendering to file {0}".format(self.outputFile))
             self.update_stats("YafaRay Rendering:", "Rendering to {0}".format(self.outputFile))
             self.yi.render(self.co)
@@ -359,8 +745,17 @@ class YafaRayRenderEngine(bpy.types.RenderEngine):
                     # update_progress needs float range 0.0 to 1.0, yafaray returns 0.0 to 100.0
                     self.update_progress(self.prog / 100)
 
+            if yaf_geometry.numpy is not None:
+                # tiles go into one buffer, the updates are passed to blender from this thread
+                self.relay = yafFramebufferRelay(self, self.resX, self.resY, 0.1 if self.is_preview else 0.5)
+
             def drawAreaCallback(*args):
+                if "first pixel" not in metrics:
+                    metrics["first pixel"] = time.time() - renderStart
                 x, y, w, h, tile = args
+                if self.relay is not None:
+                    self.relay.putTile(x, y, w, h, tile)
+                    return
                 res = self.begin_result(x, y, w, h)
                 try:
                     res.layers[0].rect = tile
@@ -371,6 +766,9 @@ class YafaRayRenderEngine(bpy.types.RenderEngine):
 
             def flushCallback(*args):
                 w, h, tile = args
+                if self.relay is not None:
+                    self.relay.putTile(0, 0, w, h, tile)
+                    return
                 res = self.begin_result(0, 0, w, h)
                 try:
                     res.layers[0].rect = tile
@@ -379,30 +777,46 @@ class YafaRayRenderEngine(bpy.types.RenderEngine):
 
                 self.end_result(res)
 
-            t = threading.Thread(
-                                    target=self.yi.render,
-                                    args=(self.resX, self.resY, self.bStartX, self.bStartY,
-                                    self.is_preview,
-                                    drawAreaCallback,
-                                    flushCallback,
-                                    progressCallback)
-                                )
-            t.start()
+            t, done = self.startRender(self.resX, self.resY, self.bStartX, self.bStartY,
+                                       self.is_preview,
+                                       drawAreaCallback,
+                                       flushCallback,
+                                       progressCallback)
 
-            while t.isAlive() and not self.test_break():
-                time.sleep(0.2)
-
-            if t.isAlive():
+            finished = self.waitForRender(done)
+            if not finished:
+                abortStart = time.time()
                 self.update_stats("", "Aborting...")
                 self.yi.abort()
-                t.join()
-                self.yi.clearAll()
+            t.join()
+
+            if self.relay is not None:
+                # the complete image, whatever the refresh rate held back
+                self.relay.flush(True)
+
+            if not finished:
+                metrics["abort"] = time.time() - abortStart
+                self.writeRenderStats()
+                if self.session is not None:
+                    self.discardSession()
+                else:
+                    self.yi.clearAll()
                 del self.yi
                 self.update_stats("", "Render is aborted")
                 self.bl_use_postprocess = True
                 return
 
-        self.yi.clearAll()
+            if self.memoryOutput:
+                self.writeOutputFile(scene)
+
+        metrics["done"] = time.time() - renderStart
+        self.writeRenderStats()
+
+        if self.session is None:
+            self.yi.clearAll()
+        elif self.is_preview:
+            yaf_session.releasePreviewSession(self.session)
+            self.session = None
         del self.yi
         self.update_stats("", "Done!")
         self.bl_use_postprocess = True
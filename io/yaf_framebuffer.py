@@ -0,0 +1,89 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import threading
+import time
+from .yaf_geometry import numpy
+
+
+def tileToArray(tile, w, h):
+    # (h, w, 4) RGBA pixels of a tile reported by the renderer. The tiles are
+    # nested python lists without a buffer to view, numpy reads them element
+    # by element, so this is left to the thread that flushes the tiles
+    return numpy.array(tile, dtype=numpy.float32).reshape(h, w, 4)
+
+
+def setLayerPixels(layer, pixels):
+    # passes the (h, w, 4) pixels to a render layer as one array, blender
+    # reads it as a sequence without python lists built for every pixel
+    layer.rect = numpy.ascontiguousarray(pixels, dtype=numpy.float32).reshape(-1, 4)
+
+
+class yafFramebufferRelay:
+    # Collects the tiles of the render threads and passes the updated area
+    # to the render result of the engine, at most once every 'interval'
+    # seconds. The render threads only queue the tiles, converting them into
+    # the RGBA buffer and the update of blender are done by the thread
+    # calling flush(), the one waiting for the render
+    def __init__(self, engine, resx, resy, interval):
+        self.engine = engine
+        self.resx = resx
+        self.resy = resy
+        self.interval = interval
+        self.buffer = numpy.zeros((resy, resx, 4), dtype=numpy.float32)
+        self.lock = threading.Lock()
+        self.queued = []
+        self.lastFlush = 0.0
+        self.tiles = 0
+
+    def putTile(self, x, y, w, h, tile):
+        # called by the render threads, keeps the tile for the next flush
+        with self.lock:
+            if x <= 0 and y <= 0 and w >= self.resx and h >= self.resy:
+                # the whole image replaces the tiles before it
+                del self.queued[:]
+            self.queued.append((x, y, w, h, tile))
+            self.tiles += 1
+
+    def flush(self, force=False):
+        # passes the bounding box of all tiles since the last flush on
+        now = time.time()
+        if not force and now - self.lastFlush < self.interval:
+            return
+
+        with self.lock:
+            queued = self.queued
+            self.queued = []
+        if not queued:
+            return
+
+        x0, y0, x1, y1 = self.resx, self.resy, 0, 0
+        for x, y, w, h, tile in queued:
+            right = min(x + w, self.resx)
+            top = min(y + h, self.resy)
+            self.buffer[y:top, x:right] = tileToArray(tile, w, h)[:top - y, :right - x]
+            x0, y0, x1, y1 = min(x0, x), min(y0, y), max(x1, right), max(y1, top)
+
+        self.lastFlush = now
+        result = self.engine.begin_result(x0, y0, x1 - x0, y1 - y0)
+        try:
+            setLayerPixels(result.layers[0], self.buffer[y0:y1, x0:x1])
+        finally:
+            self.engine.end_result(result)
@@ -0,0 +1,670 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import hashlib
+import math
+
+# NumPy is bundled with the official Blender builds, but custom builds may
+# come without it. In that case the exporter falls back to the per element
+# geometry export in yafObject.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Names of batched upload methods a yafrayinterface may provide. No released
+# interface has them yet, so the per-element loops of the upload functions are
+# the code that runs, the batched branches stay inert until the calls exist
+BULK_MESH_API = ("addVertices", "addUVs", "addTriangles")
+
+
+def hasBulkMeshAPI(yi):
+    return all(hasattr(yi, name) for name in BULK_MESH_API)
+
+
+def foreachGet(collection, attr, count, dtype):
+    # Try to fill a contiguous buffer directly, older Blender builds
+    # refuse buffers whose item type differs from the raw RNA type,
+    # read into a list in that case and convert afterwards
+    buf = numpy.empty(count, dtype=dtype)
+    try:
+        collection.foreach_get(attr, buf)
+    except (TypeError, ValueError):
+        seq = [0] * count
+        collection.foreach_get(attr, seq)
+        buf = numpy.array(seq, dtype=dtype)
+    return buf
+
+
+def matrixToArray(matrix):
+    # matrix indexing is (row, column) since Blender rev.42816
+    return numpy.array([list(row) for row in matrix.to_4x4()], dtype=numpy.float64)
+
+
+def transformPoints(co, matrix):
+    if matrix is None:
+        return co
+    m = matrixToArray(matrix)
+    return (numpy.dot(co, m[:3, :3].T) + m[:3, 3]).astype(numpy.float32)
+
+
+class yafMeshBuffers:
+    # Contiguous geometry buffers of one tessellated mesh in object space:
+    #   co         (V, 3) float32 vertex positions
+    #   orco       (V, 3) float32 normalized orco positions or None
+    #   tris       (T, 3) int32 vertex indices
+    #   uvs        (U, 2) float32 uv coordinates or None
+    #   uvTris     (T, 3) int32 uv indices or None
+    #   matIndices (T,) int32 mesh material index per triangle
+    #   smoothAngle  angle for smoothMesh() or None for flat shaded meshes
+    def __init__(self, co, tris, matIndices, orco=None, uvs=None, uvTris=None, smoothAngle=None):
+        self.co = co
+        self.tris = tris
+        self.matIndices = matIndices
+        self.orco = orco
+        self.uvs = uvs
+        self.uvTris = uvTris
+        self.smoothAngle = smoothAngle
+
+    @property
+    def hasOrco(self):
+        return self.orco is not None
+
+    @property
+    def hasUV(self):
+        return self.uvs is not None
+
+    def numTriangles(self):
+        return len(self.tris)
+
+    def numVertices(self):
+        return len(self.co)
+
+
+def getMeshBuffers(obj, mesh, face_attr, hasOrco, hasUV, bbox=None):
+    faces = getattr(mesh, face_attr)
+    numVerts = len(mesh.vertices)
+    numFaces = len(faces)
+
+    co = foreachGet(mesh.vertices, "co", numVerts * 3, numpy.float32).reshape(numVerts, 3)
+
+    # tessfaces store 4 indices per face, triangles have a 0 as 4th index
+    fv = foreachGet(faces, "vertices_raw", numFaces * 4, numpy.int32).reshape(numFaces, 4)
+    isQuad = fv[:, 3] != 0
+    quads = numpy.flatnonzero(isQuad)
+
+    # split quads into (v0 v1 v2) and (v0 v2 v3) like the per element export
+    tris = numpy.concatenate((fv[:, (0, 1, 2)], fv[quads][:, (0, 2, 3)]))
+    triFaces = numpy.concatenate((numpy.arange(numFaces, dtype=numpy.int32), quads))
+
+    matIndices = foreachGet(faces, "material_index", numFaces, numpy.int32)[triFaces]
+    smooth = foreachGet(faces, "use_smooth", numFaces, numpy.bool_)
+
+    orco = None
+    if hasOrco:
+        # bring the untransformed vertices into a (-1 -1 -1) (1 1 1) bounding box
+        bbMin, bbMax = bbox
+        bbMin = numpy.array(bbMin, dtype=numpy.float32)
+        delta = numpy.array(bbMax, dtype=numpy.float32) - bbMin
+        delta[delta < 0.0001] = 1
+        orco = 2 * (co - bbMin) / delta - 1
+
+    uvs = None
+    uvTris = None
+    if hasUV:
+        uv_texture = mesh.tessface_uv_textures if 'tessface_uv_textures' in dir(mesh) else mesh.uv_textures
+        uvRaw = foreachGet(uv_texture.active.data, "uv_raw", numFaces * 8, numpy.float32).reshape(numFaces, 4, 2)
+        # every face corner gets its own uv, the 4th corner only for quads
+        corners = numpy.ones((numFaces, 4), dtype=numpy.bool_)
+        corners[:, 3] = isQuad
+        uvs = uvRaw[corners]
+        counts = 3 + isQuad.astype(numpy.int32)
+        uvStart = numpy.cumsum(counts) - counts
+        uvTris = numpy.concatenate((uvStart[:, None] + (0, 1, 2), uvStart[quads][:, None] + (0, 2, 3))).astype(numpy.int32)
+
+    smoothAngle = None
+    if smooth.any():
+        if mesh.use_auto_smooth:
+            smoothAngle = math.degrees(mesh.auto_smooth_angle)
+        elif obj.type == 'FONT':  # getting nicer result with smooth angle 60 degr. for text objects
+            smoothAngle = 60
+        else:
+            smoothAngle = 181
+
+    return yafMeshBuffers(co, tris.astype(numpy.int32), matIndices, orco, uvs, uvTris, smoothAngle)
+
+
+def uploadTriMesh(yi, ID, buffers, co, palette, obType=0):
+    # 'co' are the (maybe transformed) vertex positions to send, the rest is
+    # taken from the buffers. 'palette' maps mesh material indices to materials
+    matIndices = numpy.clip(buffers.matIndices, 0, len(palette) - 1)
+
+    yi.paramsClearAll()
+    yi.startGeometry()
+
+    yi.startTriMesh(ID, len(co), buffers.numTriangles(), buffers.hasOrco, buffers.hasUV, obType)
+
+    if hasBulkMeshAPI(yi):
+        # inert with the current interfaces, see BULK_MESH_API
+        if buffers.hasOrco:
+            yi.addVertices(numpy.ascontiguousarray(co), numpy.ascontiguousarray(buffers.orco))
+        else:
+            yi.addVertices(numpy.ascontiguousarray(co))
+        if buffers.hasUV:
+            uvBase = yi.addUVs(numpy.ascontiguousarray(buffers.uvs))
+            yi.addTriangles(buffers.tris, buffers.uvTris + uvBase, matIndices, palette)
+        else:
+            yi.addTriangles(buffers.tris, matIndices, palette)
+    else:
+        # one interface call per vertex, uv and triangle, the path of all current interfaces
+        addVertex = yi.addVertex
+        addTriangle = yi.addTriangle
+        if buffers.hasOrco:
+            for (x, y, z), (ox, oy, oz) in zip(co.tolist(), buffers.orco.tolist()):
+                addVertex(x, y, z, ox, oy, oz)
+        else:
+            for x, y, z in co.tolist():
+                addVertex(x, y, z)
+
+        if buffers.hasUV:
+            addUV = yi.addUV
+            uvIds = [addUV(u, v) for u, v in buffers.uvs.tolist()]
+            for (a, b, c), (ua, ub, uc), m in zip(buffers.tris.tolist(), buffers.uvTris.tolist(), matIndices.tolist()):
+                addTriangle(a, b, c, uvIds[ua], uvIds[ub], uvIds[uc], palette[m])
+        else:
+            for (a, b, c), m in zip(buffers.tris.tolist(), matIndices.tolist()):
+                addTriangle(a, b, c, palette[m])
+
+    yi.endTriMesh()
+
+    if buffers.smoothAngle is not None:
+        yi.smoothMesh(0, buffers.smoothAngle)
+
+    yi.endGeometry()
+
+
+def uploadEmptyMesh(yi, ID, obType=0):
+    # a mesh without triangles, replaces the geometry at ID
+    yi.paramsClearAll()
+    yi.startGeometry()
+    yi.startTriMesh(ID, 0, 0, False, False, obType)
+    yi.endTriMesh()
+    yi.endGeometry()
+
+
+class yafStrandBuffers:
+    # Hair keys of one particle system:
+    #   co       (K, 3) float32 key positions of all strands, strand after strand
+    #   counts   (N,) int32 number of keys per strand
+    #   visible  (N,) bool strands that exist and are visible
+    def __init__(self, co, counts, visible):
+        self.co = co
+        self.counts = counts
+        self.visible = visible
+
+    def numStrands(self):
+        return len(self.counts)
+
+    def numKeys(self):
+        return len(self.co)
+
+
+def readHairKeys(keys, out):
+    # the key positions of one strand into the float32 view 'out'
+    try:
+        keys.foreach_get("co", out)
+    except (TypeError, ValueError):
+        seq = [0.0] * len(out)
+        keys.foreach_get("co", seq)
+        out[:] = seq
+
+
+def getStrandBuffers(pSys):
+    # Blender only exposes the hair keys per particle, there is no flat key
+    # collection, so this stays a python loop over the particles with one
+    # foreach_get per strand into its part of the key buffer. Strands of hair
+    # systems usually all have the same number of keys and fill the rows of
+    # one (N, K * 3) array
+    particles = pSys.particles
+    numParticles = len(particles)
+
+    visible = foreachGet(particles, "is_exist", numParticles, numpy.bool_)
+    visible &= foreachGet(particles, "is_visible", numParticles, numpy.bool_)
+
+    hairKeys = [p.hair_keys for p in particles]
+    counts = numpy.fromiter(map(len, hairKeys), dtype=numpy.int32, count=numParticles)
+
+    if numParticles and (counts == counts[0]).all():
+        co = numpy.empty((numParticles, int(counts[0]) * 3), dtype=numpy.float32)
+        for keys, row in zip(hairKeys, co):
+            readHairKeys(keys, row)
+    else:
+        co = numpy.empty(int(counts.sum()) * 3, dtype=numpy.float32)
+        ends = numpy.cumsum(counts * 3).tolist()
+        for keys, start, end in zip(hairKeys, [0] + ends, ends):
+            readHairKeys(keys, co[start:end])
+
+    return yafStrandBuffers(co.reshape(-1, 3), counts, visible)
+
+
+def simplifyStrands(strands, view, pixelThreshold, minDensity, curvatureTolerance):
+    # Hair level of detail for strands in world space. Strands whose length
+    # covers less than 'pixelThreshold' pixels are thinned out down to
+    # 'minDensity', the remaining strands get wider to keep the coverage.
+    # Keys are dropped along nearly straight parts, as long as the summed
+    # up bending since the last kept key stays below 'curvatureTolerance'.
+    # Returns the new strands and the width scale of every strand.
+    co = strands.co
+    counts = strands.counts
+    numStrands = len(counts)
+    starts = numpy.cumsum(counts) - counts
+    strandIds = numpy.repeat(numpy.arange(numStrands), counts)
+    # first key of every strand, clamped for strands without keys
+    firstKeys = numpy.minimum(starts, max(len(co) - 1, 0))
+
+    seg = co[1:] - co[:-1]
+    segLen = numpy.sqrt((seg * seg).sum(axis=1))
+    inStrand = strandIds[1:] == strandIds[:-1]
+    length = numpy.bincount(strandIds[:-1][inStrand], weights=segLen[inStrand], minlength=numStrands)
+
+    # density from the projected size of the strands
+    hasKeys = counts > 0
+    size = length * view.pixelsPerUnit(co[firstKeys]) if len(co) else length
+    density = numpy.clip(size / max(pixelThreshold, 1e-6), max(minDensity, 1e-3), 1.0)
+    # low discrepancy sequence, keeps the thinned out strands evenly spread
+    keepStrand = hasKeys & ((numpy.arange(numStrands) * 0.6180339887) % 1.0 < density)
+
+    keepKey = keepStrand[strandIds]
+
+    if curvatureTolerance > 0 and len(co) > 2:
+        # bending angle at every key, zero at the strand ends
+        direction = seg / numpy.maximum(segLen, 1e-10)[:, None]
+        cosAngle = numpy.clip((direction[1:] * direction[:-1]).sum(axis=1), -1.0, 1.0)
+        angle = numpy.zeros(len(co))
+        angle[1:-1] = numpy.where(inStrand[1:] & inStrand[:-1], numpy.arccos(cosAngle), 0.0)
+
+        # summed up bending along every strand, keep a key when it passes
+        # the next multiple of the tolerance
+        bent = numpy.cumsum(angle)
+        bent -= bent[firstKeys][strandIds]
+        steps = numpy.floor(bent / curvatureTolerance)
+        first = numpy.zeros(len(co), dtype=numpy.bool_)
+        first[starts[hasKeys]] = True
+        last = numpy.zeros(len(co), dtype=numpy.bool_)
+        last[(starts + counts - 1)[hasKeys]] = True
+        changed = numpy.ones(len(co), dtype=numpy.bool_)
+        changed[1:] = steps[1:] != steps[:-1]
+        keepKey &= first | last | changed
+
+    newCounts = numpy.bincount(strandIds[keepKey], minlength=numStrands)[keepStrand].astype(numpy.int32)
+    simplified = yafStrandBuffers(co[keepKey], newCounts, strands.visible[keepStrand])
+
+    return simplified, (1.0 / density[keepStrand]).astype(numpy.float32)
+
+
+def uploadCurves(yi, strands, co, ymaterial, strandStart, strandEnd, strandShape, widthScale=None):
+    # 'co' are the (maybe transformed) key positions to send,
+    # 'widthScale' optionally scales root and tip size per strand
+    yi.paramsClearAll()
+    yi.startGeometry()
+
+    if widthScale is None:
+        widthScale = numpy.ones(strands.numStrands(), dtype=numpy.float32)
+
+    if hasattr(yi, "addCurves"):
+        # the whole particle system as one curve batch, no yafrayinterface
+        # has addCurves() yet so this is inert until the interface adds it
+        CID = yi.getNextFreeID()
+        yi.addCurves(CID, numpy.ascontiguousarray(co), strands.counts, strands.visible,
+                     ymaterial, strandStart * widthScale, strandEnd * widthScale, strandShape)
+    else:
+        # one curve mesh and one call per key, the path of all current interfaces
+        getNextFreeID = yi.getNextFreeID
+        startCurveMesh = yi.startCurveMesh
+        addVertex = yi.addVertex
+        endCurveMesh = yi.endCurveMesh
+        keys = co.tolist()
+        offset = 0
+        for count, visible, scale in zip(strands.counts.tolist(), strands.visible.tolist(), widthScale.tolist()):
+            startCurveMesh(getNextFreeID(), visible)
+            for x, y, z in keys[offset:offset + count]:
+                addVertex(x, y, z)
+            endCurveMesh(ymaterial, strandStart * scale, strandEnd * scale, strandShape)
+            offset += count
+
+    yi.endGeometry()
+
+
+def worldCorners(obj, matrices):
+    # world space bounding box corners (N, 8, 3) of the instances of obj
+    # placed by the object to world matrices (N, 4, 4)
+    box = numpy.array([corner[:] for corner in obj.bound_box], dtype=numpy.float64)
+    return numpy.einsum('nij,mj->nmi', matrices[:, :3, :3], box) + matrices[:, None, :3, 3]
+
+
+def boundingSpheres(corners):
+    # centers (N, 3) and radii (N,) of spheres around the corners (N, M, 3)
+    centers = corners.mean(axis=1)
+    radii = numpy.linalg.norm(corners - centers[:, None], axis=2).max(axis=1)
+    return centers, radii
+
+
+# reduced detail levels merge the vertices of the evaluated mesh,
+# small meshes aren't worth it
+LOD_MIN_FACES = 500
+
+
+def hasDetailLevels(obj):
+    if obj.type in {'CURVE', 'SURFACE', 'FONT'}:
+        return True
+    if obj.type != 'MESH':
+        return False
+    if any(m.type in {'SUBSURF', 'MULTIRES'} and m.show_render and m.render_levels > 0 for m in obj.modifiers):
+        return True
+    faces = obj.data.polygons if hasattr(obj.data, "polygons") else obj.data.faces
+    return len(faces) >= LOD_MIN_FACES
+
+
+def clusterAverage(cluster, numClusters, weights, values):
+    # mean of the rows of 'values' (V, C) per cluster
+    return numpy.column_stack([numpy.bincount(cluster, values[:, i], numClusters) for i in range(values.shape[1])]) / weights[:, None]
+
+
+def reduceDetail(buffers, level):
+    # Buffers with about 0.5 ** level of the vertices of 'buffers', the
+    # vertices within the cells of a grid are merged into one. Works on the
+    # evaluated mesh, the objects and their data stay untouched
+    if buffers is None or not level or buffers.numTriangles() < LOD_MIN_FACES:
+        return buffers
+
+    co = buffers.co.astype(numpy.float64)
+    tris = buffers.tris
+    area = 0.5 * numpy.linalg.norm(numpy.cross(co[tris[:, 1]] - co[tris[:, 0]], co[tris[:, 2]] - co[tris[:, 0]]), axis=1).sum()
+    # the vertices of a surface are spread over its area
+    cellSize = math.sqrt(area / max(buffers.numVertices() * 0.5 ** level, 4))
+    if not cellSize > 0.0:
+        return buffers
+
+    cells = numpy.floor((co - co.min(axis=0)) / cellSize).astype(numpy.int64)
+    dims = cells.max(axis=0) + 1
+    cellIds = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    cluster = numpy.unique(cellIds, return_inverse=True)[1].ravel()
+    numClusters = int(cluster.max()) + 1
+    weights = numpy.bincount(cluster, minlength=numClusters).astype(numpy.float64)
+
+    newTris = cluster[tris]
+    keep = (newTris[:, 0] != newTris[:, 1]) & (newTris[:, 1] != newTris[:, 2]) & (newTris[:, 0] != newTris[:, 2])
+    if not keep.any():
+        return buffers
+
+    newCo = clusterAverage(cluster, numClusters, weights, co).astype(numpy.float32)
+    orco = None
+    if buffers.hasOrco:
+        orco = clusterAverage(cluster, numClusters, weights, buffers.orco).astype(numpy.float32)
+
+    uvs = None
+    uvTris = None
+    if buffers.hasUV:
+        # only the uvs of the remaining triangles are kept
+        used, uvTris = numpy.unique(buffers.uvTris[keep], return_inverse=True)
+        uvs = buffers.uvs[used]
+        uvTris = uvTris.reshape(-1, 3).astype(numpy.int32)
+
+    return yafMeshBuffers(newCo, newTris[keep].astype(numpy.int32), buffers.matIndices[keep], orco, uvs, uvTris, buffers.smoothAngle)
+
+
+def quaternionsToMatrices(quats):
+    # (N, 4) w x y z quaternions to (N, 3, 3) rotation matrices
+    w, x, y, z = quats[:, 0], quats[:, 1], quats[:, 2], quats[:, 3]
+    m = numpy.empty((len(quats), 3, 3), dtype=numpy.float64)
+    m[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    m[:, 0, 1] = 2 * (x * y - z * w)
+    m[:, 0, 2] = 2 * (x * z + y * w)
+    m[:, 1, 0] = 2 * (x * y + z * w)
+    m[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    m[:, 1, 2] = 2 * (y * z - x * w)
+    m[:, 2, 0] = 2 * (x * z - y * w)
+    m[:, 2, 1] = 2 * (y * z + x * w)
+    m[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return m
+
+
+def getDirectParticleSystems(obj):
+    # Particle systems whose object duplis can be built from the particle
+    # states directly: emitter particles without children, duplicating a
+    # single object. Returns None if the object needs a dupli list anyway.
+    if obj.dupli_type != 'NONE':
+        return None
+
+    renderSystems = {m.particle_system.name for m in obj.modifiers if m.type == 'PARTICLE_SYSTEM' and m.show_render}
+    systems = []
+
+    for pSys in obj.particle_systems:
+        settings = pSys.settings
+        if settings.render_type not in {'OBJECT', 'GROUP'} or pSys.name not in renderSystems:
+            continue
+        if settings.render_type != 'OBJECT' or settings.type != 'EMITTER' or settings.child_type != 'NONE':
+            return None
+        systems.append(pSys)
+
+    return systems
+
+
+def getParticleMatrices(pSys, frame, objectMatrix, offset):
+    # object to world matrices (N, 4, 4) of the duplis of an emitter particle
+    # system: particle rotation * 'objectMatrix' (3x3 orientation and scale
+    # of the dupli object) * particle size, at the particle location + 'offset'
+    settings = pSys.settings
+    particles = pSys.particles
+    numParticles = len(particles)
+
+    show = foreachGet(particles, "is_exist", numParticles, numpy.bool_)
+    show &= foreachGet(particles, "is_visible", numParticles, numpy.bool_)
+
+    birth = foreachGet(particles, "birth_time", numParticles, numpy.float32)
+    death = foreachGet(particles, "die_time", numParticles, numpy.float32)
+    if not settings.show_unborn:
+        show &= birth <= frame
+    if not settings.use_dead:
+        show &= death > frame
+
+    loc = foreachGet(particles, "location", numParticles * 3, numpy.float32).reshape(-1, 3)[show]
+    rot = foreachGet(particles, "rotation", numParticles * 4, numpy.float32).reshape(-1, 4)[show]
+    size = foreachGet(particles, "size", numParticles, numpy.float32)[show]
+
+    matrices = numpy.zeros((len(loc), 4, 4), dtype=numpy.float64)
+    matrices[:, :3, :3] = numpy.einsum('nij,jk->nik', quaternionsToMatrices(rot.astype(numpy.float64)), objectMatrix)
+    matrices[:, :3, :3] *= size[:, None, None]
+    matrices[:, :3, 3] = loc + offset
+    matrices[:, 3, 3] = 1.0
+
+    return matrices
+
+
+def contentFingerprint(buffers, materials):
+    # hash of the object space geometry, topology, uvs and material
+    # assignment, meshes with equal hashes can share one instance base
+    h = hashlib.md5()
+    for buf in (buffers.co, buffers.tris, buffers.matIndices, buffers.orco, buffers.uvs, buffers.uvTris):
+        if buf is None:
+            h.update(b"-")
+        else:
+            h.update(repr(buf.shape).encode())
+            h.update(numpy.ascontiguousarray(buf).tobytes())
+    h.update(repr((buffers.smoothAngle, materials)).encode())
+    return h.hexdigest()
+
+
+# Modifiers whose result changes over time even if none of their settings do
+TIME_DEPENDENT_MODIFIERS = {'CLOTH', 'SOFT_BODY', 'FLUID_SIMULATION', 'SMOKE', 'OCEAN',
+                            'DYNAMIC_PAINT', 'EXPLODE', 'PARTICLE_INSTANCE', 'WAVE', 'BUILD',
+                            'MESH_CACHE', 'COLLISION'}
+
+
+def objectState(ob):
+    # transformation of an object, and the pose of armatures, as used by deformers
+    state = [ob.name, ob.matrix_world]
+    if ob.type == 'ARMATURE' and ob.pose:
+        state.extend(pb.matrix for pb in ob.pose.bones)
+    return state
+
+
+def usesObjectSpace(mod):
+    # modifiers relative to other objects or to world space (hooks, mirror
+    # and array offset objects, global texture coordinates...) change with
+    # the transformation of the modified object itself
+    if getattr(mod, "texture_coords", None) == 'GLOBAL':
+        return True
+    if mod.type == 'UV_PROJECT':
+        return any(p.object for p in mod.projectors)
+    for prop in mod.bl_rna.properties:
+        if prop.type == 'POINTER' and hasattr(getattr(mod, prop.identifier, None), "matrix_world"):
+            return True
+    return False
+
+
+def rnaSignature(struct, follow=True):
+    # values of all plain RNA properties, objects are represented by their
+    # state, other datablocks (textures of displace modifiers...) by their
+    # own settings if 'follow' is set
+    values = []
+    for prop in struct.bl_rna.properties:
+        ident = prop.identifier
+        if ident == "rna_type" or prop.type == 'COLLECTION':
+            continue
+        value = getattr(struct, ident, None)
+        if prop.type == 'POINTER' and value is not None:
+            if hasattr(value, "matrix_world"):
+                value = objectState(value)
+            elif follow:
+                value = rnaSignature(value, False)
+            else:
+                value = getattr(value, "name", None)
+        elif getattr(prop, "array_length", 0):
+            value = list(value)
+        values.append((ident, value))
+    return values
+
+
+# per point values of the spline points, with their number of floats
+SPLINE_POINT_VALUES = (
+    ("bezier_points", (("co", 3), ("handle_left", 3), ("handle_right", 3), ("radius", 1), ("tilt", 1))),
+    ("points", (("co", 4), ("radius", 1), ("tilt", 1), ("weight", 1))),
+)
+
+
+def splineSignature(data):
+    # the splines and their points, collections are left out by rnaSignature()
+    h = hashlib.md5()
+    for spline in data.splines:
+        h.update(repr(rnaSignature(spline, False)).encode())
+        for attr, values in SPLINE_POINT_VALUES:
+            points = getattr(spline, attr)
+            for name, size in values:
+                seq = [0.0] * (len(points) * size)
+                points.foreach_get(name, seq)
+                h.update(repr(seq).encode())
+    return h.hexdigest()
+
+
+def isAnimated(block):
+    animation = getattr(block, "animation_data", None)
+    return animation is not None and (animation.action is not None or len(animation.drivers) > 0)
+
+
+def geometryFingerprint(obj, frame):
+    # fingerprint of everything the evaluated render mesh depends on: the
+    # data block, its settings and shape keys, the modifier stack with the
+    # state of the objects it references and deforming parents
+    data = obj.data
+    parts = [obj.type, data.name, data.as_pointer(), rnaSignature(data, False)]
+
+    if obj.type in {'CURVE', 'SURFACE', 'FONT'}:
+        parts.append(splineSignature(data))
+    # keyframed or driven values of the data, like curve control points
+    if isAnimated(data):
+        parts.append(frame)
+
+    shape_keys = getattr(data, "shape_keys", None)
+    if shape_keys:
+        parts.append([shape_keys.eval_time] + [(kb.name, kb.value, kb.mute) for kb in shape_keys.key_blocks])
+
+    objectSpace = False
+    for mod in [m for m in obj.modifiers if m.show_render]:
+        if mod.type in TIME_DEPENDENT_MODIFIERS:
+            parts.append(frame)
+        parts.append((mod.type, rnaSignature(mod)))
+        objectSpace = objectSpace or usesObjectSpace(mod)
+
+    # moving the object alone only changes the mesh of these modifiers
+    if objectSpace:
+        parts.append(obj.matrix_world)
+
+    if obj.parent and obj.parent_type in {'ARMATURE', 'LATTICE', 'CURVE'}:
+        parts.append(objectState(obj.parent))
+
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+class yafGeometryCacheEntry:
+    def __init__(self, fingerprint, buffers):
+        self.fingerprint = fingerprint
+        self.buffers = buffers
+
+
+class yafGeometryCache:
+    # Prepared mesh buffers of the last frames, keyed by object. Entries not
+    # used during a frame are dropped when the frame ends.
+    def __init__(self):
+        self.entries = {}
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.entries.clear()
+        self.used.clear()
+
+    def beginFrame(self):
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+    def endFrame(self):
+        for key in [k for k in self.entries if k not in self.used]:
+            del self.entries[key]
+
+    def lookup(self, key, fingerprint):
+        self.used.add(key)
+        entry = self.entries.get(key)
+        if entry is not None and entry.fingerprint == fingerprint:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, fingerprint, buffers):
+        self.used.add(key)
+        self.entries[key] = yafGeometryCacheEntry(fingerprint, buffers)
+
+
+# Lives as long as the addon, render engine instances only last one frame
+geometryCache = yafGeometryCache()
@@ -0,0 +1,202 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import concurrent.futures
+import hashlib
+import os
+import tempfile
+from bpy.path import abspath
+
+# file extensions of packed images without one in their path
+FORMAT_EXTENSIONS = {
+    'PNG': ".png",
+    'JPEG': ".jpg",
+    'TARGA': ".tga",
+    'TARGA_RAW': ".tga",
+    'TIFF': ".tif",
+    'HDR': ".hdr",
+    'OPEN_EXR': ".exr",
+    'BMP': ".bmp",
+}
+
+
+def packedData(image):
+    # the packed file as bytes, older blender versions don't expose them
+    if image.source != 'FILE' or not image.packed_file:
+        return None
+    return getattr(image.packed_file, "data", None) or None
+
+
+def packedExtension(image):
+    extension = os.path.splitext(image.filepath)[1].lower()
+    return extension or FORMAT_EXTENSIONS.get(image.file_format, ".png")
+
+
+def settingsValues(struct):
+    # the plain RNA values of a settings struct
+    values = []
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == "rna_type" or prop.type in {'POINTER', 'COLLECTION'}:
+            continue
+        value = getattr(struct, prop.identifier)
+        if getattr(prop, "array_length", 0):
+            value = tuple(value)
+        values.append((prop.identifier, value))
+    return values
+
+
+def generatedKey(image, scene, fileformat):
+    # everything save_render() output of a generated image depends on: the
+    # image, the output format and depth and the color management
+    view = scene.view_settings
+    settings = [image.generated_type, tuple(image.size), tuple(image.generated_color), image.use_generated_float,
+                fileformat, settingsValues(scene.render.image_settings), settingsValues(scene.display_settings),
+                settingsValues(view)]
+    if view.use_curve_mapping:
+        settings.append([[tuple(point.location) for point in curve.points] for curve in view.curve_mapping.curves])
+    return hashlib.sha1(repr(settings).encode("utf-8")).hexdigest()
+
+
+def cacheDirectory(directory, subdirectory="", create=True):
+    # the directory is created if needed, raises OSError if it can't be
+    directory = os.path.realpath(abspath(directory or os.path.join(tempfile.gettempdir(), "yafaray_image_cache")))
+    if subdirectory:
+        directory = os.path.join(directory, subdirectory)
+    if create and not os.path.isdir(directory):
+        os.makedirs(directory)
+    return directory
+
+
+def touch(path):
+    # the modification time orders the entries for the eviction
+    try:
+        os.utime(path, None)
+        return True
+    except OSError:
+        return False
+
+
+def storePacked(directory, data, extension):
+    # runs on the worker threads, returns the digest, the path and if the entry was written
+    digest = hashlib.sha1(data).hexdigest()
+    path = os.path.join(directory, digest + extension)
+    if touch(path):
+        return digest, path, False
+
+    temp = "{0}.{1:d}.part".format(path, os.getpid())
+    with open(temp, "wb") as f:
+        f.write(data)
+    os.replace(temp, path)
+    return digest, path, True
+
+
+def evict(directory, limit):
+    # removes the least recently used entries until the cache, with the
+    # texture proxies in its subdirectories, fits into 'limit' bytes
+    entries = []
+    for folder, subfolders, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(entry[1] for entry in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    return total
+
+
+# packed images are hashed and written in parallel
+workers = None
+
+
+def getWorkers():
+    global workers
+    if workers is None:
+        workers = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    return workers
+
+
+class yafImageCache:
+    # Content addressed directory of the packed and generated images of the
+    # scene, the files are only written when no entry with the same content exists
+    def __init__(self, directory, limit):
+        self.directory = cacheDirectory(directory)
+        self.limit = limit
+        # image name -> future of (digest, path) of the packed images of this export
+        self.packed = {}
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, images):
+        # start the extraction of the packed images before their textures need them,
+        # the images are stored in parallel
+        for image in images:
+            if image.users and image.name not in self.packed:
+                data = packedData(image)
+                if data is not None:
+                    self.packed[image.name] = getWorkers().submit(storePacked, self.directory, data, packedExtension(image))
+
+    def handles(self, image):
+        if image.source == 'GENERATED':
+            # painted images differ from their settings
+            return not image.is_dirty
+        self.prefetch([image])
+        job = self.packed.get(image.name)
+        # images the cache failed to store are extracted the old way
+        return job is not None and job.exception() is None
+
+    def packedDigest(self, image):
+        return self.packed[image.name].result()[0]
+
+    def extract(self, image, scene, fileformat):
+        # path of the cache entry with the pixels of the image
+        if image.source != 'GENERATED':
+            return self.packed[image.name].result()[1]
+
+        path = os.path.join(self.directory, "{0}.{1}".format(generatedKey(image, scene, fileformat), fileformat))
+        if touch(path):
+            self.hits += 1
+            return path
+
+        self.misses += 1
+        temp = "{0}.part.{1}".format(path[:-len(fileformat) - 1], fileformat)
+        image.save_render(temp, scene)
+        os.replace(temp, path)
+        return path
+
+    def summary(self):
+        written = [job.result()[2] for job in self.packed.values() if job.done() and not job.exception()]
+        hits = self.hits + written.count(False)
+        misses = self.misses + written.count(True)
+        return "Image cache: {0:d} images reused, {1:d} extracted".format(hits, misses)
+
+    def finish(self):
+        # the cache is trimmed in the background
+        return getWorkers().submit(evict, self.directory, self.limit)
@@ -0,0 +1,118 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import concurrent.futures
+import os
+import struct
+import zlib
+from .yaf_geometry import numpy
+
+# The pixel buffers are (height, width, 4) float32 RGBA arrays with the
+# bottom row first, like the render result of blender
+
+
+def to8Bit(pixels, channels):
+    return (numpy.clip(pixels[:, :, :channels], 0.0, 1.0) * 255.0 + 0.5).astype(numpy.uint8)
+
+
+def encodePNG(pixels, alpha):
+    channels = 4 if alpha else 3
+    data = to8Bit(pixels[::-1], channels)
+    h, w = data.shape[:2]
+
+    # every scanline starts with its filter type, 0 = none
+    raw = numpy.zeros((h, w * channels + 1), dtype=numpy.uint8)
+    raw[:, 1:] = data.reshape(h, -1)
+
+    def chunk(tag, body):
+        return struct.pack(">I", len(body)) + tag + body + struct.pack(">I", zlib.crc32(tag + body) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", w, h, 8, 6 if alpha else 2, 0, 0, 0)
+    return b"".join((b"\x89PNG\r\n\x1a\n",
+                     chunk(b"IHDR", header),
+                     chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)),
+                     chunk(b"IEND", b"")))
+
+
+def encodeTGA(pixels, alpha):
+    # uncompressed true color, the rows start at the bottom left like the buffer
+    channels = 4 if alpha else 3
+    data = to8Bit(pixels, channels)
+    h, w = data.shape[:2]
+    bgr = data[:, :, [2, 1, 0, 3][:channels]]
+
+    header = struct.pack("<BBBHHBHHHHBB", 0, 0, 2, 0, 0, 0, 0, 0, w, h, channels * 8, 8 if alpha else 0)
+    return header + numpy.ascontiguousarray(bgr).tobytes()
+
+
+def encodeHDR(pixels, alpha):
+    # flat RGBE scanlines from the top, radiance files have no alpha
+    rgb = numpy.maximum(pixels[::-1, :, :3], 0.0)
+    h, w = rgb.shape[:2]
+    brightest = rgb.max(axis=2)
+    mantissa, exponent = numpy.frexp(brightest)
+
+    rgbe = numpy.zeros((h, w, 4), dtype=numpy.uint8)
+    visible = brightest > 1e-32
+    scale = numpy.where(visible, mantissa * 256.0 / numpy.where(visible, brightest, 1.0), 0.0)
+    rgbe[:, :, :3] = numpy.minimum(rgb * scale[:, :, None], 255.0).astype(numpy.uint8)
+    rgbe[:, :, 3] = numpy.where(visible, exponent + 128, 0).astype(numpy.uint8)
+
+    header = "#?RADIANCE\nFORMAT=32-bit_rle_rgbe\n\n-Y {0:d} +X {1:d}\n".format(h, w)
+    return header.encode("ascii") + rgbe.tobytes()
+
+
+# EXR stays with the image handler of yafaray, it writes compressed
+# files and is the one that can add the z-buffer
+ENCODERS = {
+    "png": encodePNG,
+    "tga": encodeTGA,
+    "hdr": encodeHDR,
+}
+
+
+def canEncode(filetype):
+    return numpy is not None and filetype in ENCODERS
+
+
+def writeImage(path, filetype, pixels, alpha):
+    data = ENCODERS[filetype](pixels, alpha)
+    # never leave a half written image behind
+    temp = path + ".part"
+    with open(temp, "wb") as f:
+        f.write(data)
+    os.replace(temp, path)
+    return path
+
+
+# images are written one after the other, off the render thread
+writer = None
+
+
+def getWriter():
+    global writer
+    if writer is None:
+        writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    return writer
+
+
+def writeImageAsync(path, filetype, pixels, alpha):
+    # 'pixels' must not be changed anymore by the caller
+    return getWriter().submit(writeImage, path, filetype, pixels, alpha)
@@ -0,0 +1,105 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import bpy
+
+GEOMETRY_TYPES = {'MESH', 'SURFACE', 'CURVE', 'FONT', 'EMPTY'}
+
+
+def layerMask(layers):
+    mask = 0
+    for i, visible in enumerate(layers):
+        if visible:
+            mask |= 1 << i
+    return mask
+
+
+class yafExportIndex:
+    # What the export of a frame needs from the objects of the scene,
+    # collected in one pass: the camera and the lamps and geometry objects
+    # to export. The materials and textures are added when the exported
+    # objects use them
+    def __init__(self, scene, isPreview=False):
+        self.scene = scene
+        self.isPreview = isPreview
+        self.sceneMask = layerMask(scene.layers)
+        # only the visible scene layers need to be looked up on the objects
+        self.sceneLayers = [i for i in range(len(scene.layers)) if self.sceneMask & (1 << i)]
+
+        self.camera = None
+        self.lamps = []
+        self.geometry = []
+        # materials and textures in use, in the order of their first use
+        self.materials = []
+        self.textures = []
+        self.materialNames = set()
+        self.textureNames = set()
+
+        for obj in scene.objects:
+            objType = obj.type
+            if objType == 'CAMERA' and self.camera is None:
+                self.camera = obj
+
+            if obj.hide_render:
+                continue
+            if objType == 'LAMP':
+                if obj.is_visible(scene):
+                    self.lamps.append(obj)
+            elif objType in GEOMETRY_TYPES:
+                if (obj.is_visible(scene) or obj.hide) and self.onVisibleLayer(obj):
+                    self.geometry.append(obj)
+
+    def onVisibleLayer(self, obj):
+        layers = obj.layers
+        for i in self.sceneLayers:
+            if layers[i]:
+                return True
+        return False
+
+    def addMaterial(self, material):
+        # returns the textures the material depends on that are not in the index yet
+        if material is None or material.name in self.materialNames:
+            return []
+        self.materialNames.add(material.name)
+        start = len(self.textures)
+
+        # the blended materials and their textures go first
+        if material.mat_type == 'blend':
+            mat1 = bpy.data.materials.get(material.material1)
+            mat2 = bpy.data.materials.get(material.material2)
+            # a missing material is reported by the material export
+            if mat1 is not None and mat2 is not None:
+                self.addMaterial(mat1)
+                self.addMaterial(mat2)
+        self.materials.append(material)
+        self.addTextures(material)
+
+        return self.textures[start:]
+
+    def addTextures(self, material):
+        for tex_slot in material.texture_slots:
+            if not (tex_slot and tex_slot.texture and tex_slot.use):
+                continue
+            tex = tex_slot.texture
+            if self.isPreview and tex.name == "fakeshadow":
+                continue
+            if tex.name not in self.textureNames:
+                self.textureNames.add(tex.name)
+                self.textures.append(tex)
@@ -20,6 +20,8 @@
 
 import bpy
 import yafrayinterface
+from .yaf_shadergraph import yafShaderGraph
+from .yaf_params import yafParamsRecorder
 
 
 def proj2int(val):
@@ -38,18 +40,49 @@ class yafMaterial:
         self.yi = interface
         self.materialMap = mMap
         self.textureMap = texMap
+        self.preview = False
+        self.gamma = 1.0
+        # recorded params -> (name, material), material name -> name of the identical material created
+        self.fingerprints = {}
+        self.canonicalNames = {}
+        self.sharedMaterials = 0
+
+    def setScene(self, scene):
+        # image textures are linearized with the input gamma
+        self.gamma = scene.gs_gamma_input
 
     def namehash(self, obj):
         nh = obj.name + "-" + str(obj.__hash__())
         return nh
 
-    def getUsedTextures(self, material):
-        used_textures = []
-        for tex_slot in material.texture_slots:
-            if tex_slot and tex_slot.use and tex_slot.texture:
-                used_textures.append(tex_slot)
+    def canonicalName(self, mat):
+        # the name the renderer knows an identical material by
+        nh = self.namehash(mat)
+        return self.canonicalNames.get(nh, nh)
+
+    def compileShaderGraph(self, mat, channels):
+        # 'channels' are (material input, layer name prefix, slot flag, base value, slot factor)
+        graph = yafShaderGraph(self.textureMap, self.preview, self.gamma)
+        for param, prefix, flag, base, factor in channels:
+            graph.addChannel(param, prefix, mat, flag, base, factor)
+        return graph
+
+    def writeShaderGraph(self, mat, graph):
+        for name, mtex in graph.mappers.values():
+            self.writeMappingNode(name, self.textureMap[mtex.texture.name], mtex)
+        for channel in graph.channels.values():
+            for layer in channel.layers:
+                self.writeTexLayer(layer.name, layer.mapper, layer.upper, layer.mtex, True, channel.base, layer.factor)
 
-        return used_textures
+        yi = self.yi
+        yi.paramsEndList()
+        for channel in graph.channels.values():
+            if channel.layers:
+                yi.paramsSetString(channel.param, channel.root)
+
+        removed = graph.removedNodes()
+        if removed:
+            yi.printInfo("Exporter: Removed {0:d} shader nodes without effect from material \"{1}\"".format(removed, mat.name))
 
     def writeTexLayer(self, name, tex_in, ulayer, mtex, chanflag, dcol, factor):
         if mtex.name not in self.textureMap:
@@ -219,8 +252,14 @@ class yafMaterial:
 
         yi.paramsSetInt("glass_internal_reflect_depth", mat.glass_internal_reflect_depth)
         yi.paramsSetFloat("IOR", mat.IOR_refraction)  # added IOR for refraction
+
+        graph = self.compileShaderGraph(mat, [
+            ("mirror_color_shader", "mircol_layer", "use_map_mirror", mat.glass_mir_col, "mirror_factor"),
+            ("bump_shader", "bump_layer", "use_map_normal", [0], "normal_factor"),
+        ])
+
         filt_col = mat.filter_color
-        mir_col = mat.glass_mir_col
+        mir_col = graph.base("mirror_color_shader")
         tfilt = mat.glass_transmit
         abs_col = mat.absorption
 
@@ -233,34 +272,7 @@ class yafMaterial:
         yi.paramsSetFloat("dispersion_power", mat.dispersion_power)
         yi.paramsSetBool("fake_shadows", mat.fake_shadows)
 
-        mcolRoot = ''
-        # fcolRoot = '' /* UNUSED */
-        bumpRoot = ''
-
-        i = 0
-        used_textures = self.getUsedTextures(mat)
-
-        for mtex in used_textures:
-            used = False
-            mappername = "map%x" % i
-
-            lname = "mircol_layer%x" % i
-            if self.writeTexLayer(lname, mappername, mcolRoot, mtex, mtex.use_map_mirror, mir_col, mtex.mirror_factor):
-                used = True
-                mcolRoot = lname
-            lname = "bump_layer%x" % i
-            if self.writeTexLayer(lname, mappername, bumpRoot, mtex, mtex.use_map_normal, [0], mtex.normal_factor):
-                used = True
-                bumpRoot = lname
-            if used:
-                self.writeMappingNode(mappername, mtex.texture.name, mtex)
-                i += 1
-
-        yi.paramsEndList()
-        if len(mcolRoot) > 0:
-            yi.paramsSetString("mirror_color_shader", mcolRoot)
-        if len(bumpRoot) > 0:
-            yi.paramsSetString("bump_shader", bumpRoot)
+        self.writeShaderGraph(mat, graph)
 
         return yi.createMaterial(self.namehash(mat))
 
@@ -276,8 +288,15 @@ class yafMaterial:
         else:
             yi.paramsSetString("type", "glossy")
 
-        diffuse_color = mat.diffuse_color
-        color = mat.glossy_color
+        graph = self.compileShaderGraph(mat, [
+            ("diffuse_shader", "diff_layer", "use_map_color_diffuse", mat.diffuse_color, "diffuse_color_factor"),
+            ("glossy_shader", "gloss_layer", "use_map_color_spec", mat.glossy_color, "specular_color_factor"),
+            ("glossy_reflect_shader", "glossref_layer", "use_map_specular", [mat.glossy_reflect], "specular_factor"),
+            ("bump_shader", "bump_layer", "use_map_normal", [0], "normal_factor"),
+        ])
+
+        diffuse_color = graph.base("diffuse_shader")
+        color = graph.base("glossy_shader")
 
         yi.paramsSetColor("diffuse_color", diffuse_color[0], diffuse_color[1], diffuse_color[2])
         yi.paramsSetColor("color", color[0], color[1], color[2])
@@ -289,48 +308,7 @@ class yafMaterial:
         yi.paramsSetFloat("exp_u", mat.exp_u)
         yi.paramsSetFloat("exp_v", mat.exp_v)
 
-        diffRoot = ''
-        # mcolRoot = ''  /* UNUSED */
-        glossRoot = ''
-        glRefRoot = ''
-        bumpRoot = ''
-
-        i = 0
-        used_textures = self.getUsedTextures(mat)
-
-        for mtex in used_textures:
-            used = False
-            mappername = "map%x" % i
-
-            lname = "diff_layer%x" % i
-            if self.writeTexLayer(lname, mappername, diffRoot, mtex, mtex.use_map_color_diffuse, diffuse_color, mtex.diffuse_color_factor):
-                used = True
-                diffRoot = lname
-            lname = "gloss_layer%x" % i
-            if self.writeTexLayer(lname, mappername, glossRoot, mtex, mtex.use_map_color_spec, color, mtex.specular_color_factor):
-                used = True
-                glossRoot = lname
-            lname = "glossref_layer%x" % i
-            if self.writeTexLayer(lname, mappername, glRefRoot, mtex, mtex.use_map_specular, [mat.glossy_reflect], mtex.specular_factor):
-                used = True
-                glRefRoot = lname
-            lname = "bump_layer%x" % i
-            if self.writeTexLayer(lname, mappername, bumpRoot, mtex, mtex.use_map_normal, [0], mtex.normal_factor):
-                used = True
-                bumpRoot = lname
-            if used:
-                self.writeMappingNode(mappername, mtex.texture.name, mtex)
-            i += 1
-
-        yi.paramsEndList()
-        if len(diffRoot) > 0:
-            yi.paramsSetString("diffuse_shader", diffRoot)
-        if len(glossRoot) > 0:
-            yi.paramsSetString("glossy_shader", glossRoot)
-        if len(glRefRoot) > 0:
-            yi.paramsSetString("glossy_reflect_shader", glRefRoot)
-        if len(bumpRoot) > 0:
-            yi.paramsSetString("bump_shader", bumpRoot)
+        self.writeShaderGraph(mat, graph)
 
         if mat.brdf_type == "oren-nayar":  # oren-nayar fix for glossy
             yi.paramsSetString("diffuse_brdf", "Oren-Nayar")
@@ -344,17 +322,27 @@ class yafMaterial:
         yi.paramsSetString("type", "translucent")
         yi.paramsSetFloat("IOR", mat.sssIOR)
         
-        color = mat.sssColor
-        glossyColor=mat.glossy_color;
-        specColor = mat.sssSpecularColor
-        sA = mat.sssSigmaA
-        sS = mat.sssSigmaS
         sSFactor = mat.sssSigmaS_factor
         mD = mat.diffuse_reflect
         mG = mat.glossy_reflect
         mT = mat.sss_transmit
         exp = mat.exponent
-        
+
+        graph = self.compileShaderGraph(mat, [
+            ("diffuse_shader", "diff_layer", "use_map_color_diffuse", mat.sssColor, "diffuse_color_factor"),
+            ("glossy_shader", "gloss_layer", "use_map_color_spec", mat.glossy_color, "specular_color_factor"),
+            ("glossy_reflect_shader", "glossref_layer", "use_map_specular", [mG], "specular_color_factor"),
+            ("sigmaA_shader", "transp_layer", "use_map_alpha", mat.sssSigmaA, "alpha_factor"),
+            ("sigmaS_shader", "translu_layer", "use_map_translucency", mat.sssSigmaS, "translucency_factor"),
+            ("bump_shader", "bump_layer", "use_map_normal", [0], "normal_factor"),
+        ])
+
+        color = graph.base("diffuse_shader")
+        glossyColor = graph.base("glossy_shader")
+        specColor = mat.sssSpecularColor
+        sA = graph.base("sigmaA_shader")
+        sS = graph.base("sigmaS_shader")
+
         yi.paramsSetColor("color", color[0], color[1], color[2])
         yi.paramsSetColor("glossy_color", glossyColor[0], glossyColor[1], glossyColor[2])
         yi.paramsSetColor("specular_color", specColor[0], specColor[1], specColor[2])
@@ -365,56 +353,8 @@ class yafMaterial:
         yi.paramsSetFloat("glossy_reflect",mG)
         yi.paramsSetFloat("sss_transmit",mT)
         yi.paramsSetFloat("exponent",exp)
-        
-        diffRoot = ''
-        glossRoot = ''
-        glRefRoot = ''
-        transpRoot = ''
-        translRoot = ''
-        bumpRoot = ''
-        
-        i=0
-        used_mtextures = self.getUsedTextures(mat)
-
-        for mtex in used_mtextures:
-            used = False
-            mappername = "map%x" %i
-            
-            lname = "diff_layer%x" % i
-            if self.writeTexLayer(lname, mappername, diffRoot, mtex, mtex.use_map_color_diffuse, color, mtex.diffuse_color_factor):
-                used = True
-                diffRoot = lname
-            lname = "gloss_layer%x" % i
-            if self.writeTexLayer(lname, mappername, glossRoot, mtex, mtex.use_map_color_spec, glossyColor, mtex.specular_color_factor):
-                used = True
-                glossRoot = lname
-            lname = "glossref_layer%x" % i
-            if self.writeTexLayer(lname, mappername, glRefRoot, mtex, mtex.use_map_specular, [mG], mtex.specular_color_factor):
-                used = True
-                glRefRoot = lname
-            lname = "transp_layer%x" % i
-            if self.writeTexLayer(lname, mappername, transpRoot, mtex, mtex.use_map_alpha, sA, mtex.alpha_factor):
-                used = True
-                transpRoot = lname
-            lname = "translu_layer%x" % i
-            if self.writeTexLayer(lname, mappername, translRoot, mtex, mtex.use_map_translucency, sS, mtex.translucency_factor):
-                used = True
-                translRoot = lname
-            lname = "bump_layer%x" % i
-            if self.writeTexLayer(lname, mappername, bumpRoot, mtex, mtex.use_map_normal, [0], mtex.normal_factor):
-                used = True
-                bumpRoot = lname
-            if used:
-                self.writeMappingNode(mappername, mtex.texture.name, mtex)
-            i +=1
-        
-        yi.paramsEndList()
-        if len(diffRoot) > 0:    yi.paramsSetString("diffuse_shader", diffRoot)
-        if len(glossRoot) > 0:    yi.paramsSetString("glossy_shader", glossRoot)
-        if len(glRefRoot) > 0:    yi.paramsSetString("glossy_reflect_shader", glRefRoot)
-        if len(bumpRoot) > 0:    yi.paramsSetString("bump_shader", bumpRoot)
-        if len(transpRoot) > 0:    yi.paramsSetString("sigmaA_shader", transpRoot)
-        if len(translRoot) > 0:    yi.paramsSetString("sigmaS_shader", translRoot)
+
+        self.writeShaderGraph(mat, graph)
 
         return yi.createMaterial(self.namehash(mat))
     #-------->
@@ -426,8 +366,6 @@ class yafMaterial:
 
         yi.paramsSetString("type", "shinydiffusemat")
 
-        bCol = mat.diffuse_color
-        mirCol = mat.mirror_color
         bSpecr = mat.specular_reflect
         bTransp = mat.transparency
         bTransl = mat.translucency
@@ -438,69 +376,18 @@ class yafMaterial:
             if mat.name.startswith("checker"):
                 bEmit = 0.35
 
-        i = 0
-        used_textures = self.getUsedTextures(mat)
-
-        diffRoot = ''
-        mcolRoot = ''
-        transpRoot = ''
-        translRoot = ''
-        mirrorRoot = ''
-        bumpRoot = ''
-
-        for mtex in used_textures:
-            if not mtex.texture:
-                continue
-            used = False
-            mappername = "map%x" % i
-
-            lname = "diff_layer%x" % i
-            if self.writeTexLayer(lname, mappername, diffRoot, mtex, mtex.use_map_color_diffuse, bCol, mtex.diffuse_color_factor):
-                used = True
-                diffRoot = lname
-
-            lname = "mircol_layer%x" % i
-            if self.writeTexLayer(lname, mappername, mcolRoot, mtex, mtex.use_map_mirror, mirCol, mtex.mirror_factor):
-                used = True
-                mcolRoot = lname
-
-            lname = "transp_layer%x" % i
-            if self.writeTexLayer(lname, mappername, transpRoot, mtex, mtex.use_map_alpha, [bTransp], mtex.alpha_factor):
-                used = True
-                transpRoot = lname
-
-            lname = "translu_layer%x" % i
-            if self.writeTexLayer(lname, mappername, translRoot, mtex, mtex.use_map_translucency, [bTransl], mtex.translucency_factor):
-                used = True
-                translRoot = lname
-
-            lname = "mirr_layer%x" % i
-            if self.writeTexLayer(lname, mappername, mirrorRoot, mtex, mtex.use_map_raymir, [bSpecr], mtex.raymir_factor):
-                used = True
-                mirrorRoot = lname
-
-            lname = "bump_layer%x" % i
-            if self.writeTexLayer(lname, mappername, bumpRoot, mtex, mtex.use_map_normal, [0], mtex.normal_factor):
-                used = True
-                bumpRoot = lname
-
-            if used:
-                self.writeMappingNode(mappername, mtex.texture.name, mtex)
-            i += 1
+        graph = self.compileShaderGraph(mat, [
+            ("diffuse_shader", "diff_layer", "use_map_color_diffuse", mat.diffuse_color, "diffuse_color_factor"),
+            ("mirror_color_shader", "mircol_layer", "use_map_mirror", mat.mirror_color, "mirror_factor"),
+            ("transparency_shader", "transp_layer", "use_map_alpha", [bTransp], "alpha_factor"),
+            ("translucency_shader", "translu_layer", "use_map_translucency", [bTransl], "translucency_factor"),
+            ("mirror_shader", "mirr_layer", "use_map_raymir", [bSpecr], "raymir_factor"),
+            ("bump_shader", "bump_layer", "use_map_normal", [0], "normal_factor"),
+        ])
+        self.writeShaderGraph(mat, graph)
 
-        yi.paramsEndList()
-        if len(diffRoot) > 0:
-            yi.paramsSetString("diffuse_shader", diffRoot)
-        if len(mcolRoot) > 0:
-            yi.paramsSetString("mirror_color_shader", mcolRoot)
-        if len(transpRoot) > 0:
-            yi.paramsSetString("transparency_shader", transpRoot)
-        if len(translRoot) > 0:
-            yi.paramsSetString("translucency_shader", translRoot)
-        if len(mirrorRoot) > 0:
-            yi.paramsSetString("mirror_shader", mirrorRoot)
-        if len(bumpRoot) > 0:
-            yi.paramsSetString("bump_shader", bumpRoot)
+        bCol = graph.base("diffuse_shader")
+        mirCol = graph.base("mirror_color_shader")
 
         yi.paramsSetColor("color", bCol[0], bCol[1], bCol[2])
         yi.paramsSetFloat("transparency", bTransp)
@@ -526,34 +413,16 @@ class yafMaterial:
 
         yi.printInfo("Exporter: Blend material with: [" + mat.material1 + "] [" + mat.material2 + "]")
         yi.paramsSetString("type", "blend_mat")
-        yi.paramsSetString("material1", self.namehash(bpy.data.materials[mat.material1]))
-        yi.paramsSetString("material2", self.namehash(bpy.data.materials[mat.material2]))
-
-        i = 0
-
-        diffRoot = ''
-        used_textures = self.getUsedTextures(mat)
-
-        for mtex in used_textures:
-            if mtex.texture.type == 'NONE':
-                continue
+        yi.paramsSetString("material1", self.canonicalName(bpy.data.materials[mat.material1]))
+        yi.paramsSetString("material2", self.canonicalName(bpy.data.materials[mat.material2]))
 
-            used = False
-            mappername = "map%x" % i
-
-            lname = "diff_layer%x" % i
-            if self.writeTexLayer(lname, mappername, diffRoot, mtex, mtex.use_map_diffuse, [0], mtex.diffuse_factor):
-                used = True
-                diffRoot = lname
-            if used:
-                self.writeMappingNode(mappername, mtex.texture.name, mtex)
-            i += 1
-
-        yi.paramsEndList()
+        graph = self.compileShaderGraph(mat, [
+            ("mask", "diff_layer", "use_map_diffuse", [0], "diffuse_factor"),
+        ])
+        self.writeShaderGraph(mat, graph)
 
         # if we have a blending map, disable the blend_value
-        if len(diffRoot) > 0:
-            yi.paramsSetString("mask", diffRoot)
+        if graph.channels["mask"].mapped:
             yi.paramsSetFloat("blend_value", 0)
         else:
             yi.paramsSetFloat("blend_value", mat.blend_value)
@@ -575,7 +444,22 @@ class yafMaterial:
     def writeMaterial(self, mat, preview=False):
         self.preview = preview
         self.yi.printInfo("Exporter: Creating Material: \"" + self.namehash(mat) + "\"")
-        ymat = None
+        yi = self.yi
+        recorder = self.yi = yafParamsRecorder(yi, self.fingerprints)
+        try:
+            ymat = self.writeShader(mat)
+        finally:
+            self.yi = yi
+
+        if recorder.alias is not None:
+            # duplicated materials share the first one
+            yi.printInfo("Exporter: Material \"{0}\" is identical to \"{1}\"".format(self.namehash(mat), recorder.alias))
+            self.canonicalNames[self.namehash(mat)] = recorder.alias
+            self.sharedMaterials += 1
+
+        self.materialMap[mat] = ymat
+
+    def writeShader(self, mat):
         if mat.name == "y_null":
             ymat = self.writeNullMat(mat)
         elif mat.mat_type == "glass":
@@ -597,4 +481,4 @@ class yafMaterial:
         else:
             ymat = self.writeNullMat(mat)
 
-        self.materialMap[mat] = ymat
+        return ymat
@@ -19,10 +19,14 @@
 # <pep8 compliant>
 
 import bpy
+import collections
 import time
 import math
 import mathutils
 import yafrayinterface
+from . import yaf_geometry
+from . import yaf_view
+from . import yaf_stats
 
 
 def multiplyMatrix4x4Vector4(matrix, vector):
@@ -34,13 +38,23 @@ def multiplyMatrix4x4Vector4(matrix, vector):
 
 
 class yafObject(object):
-    def __init__(self, yi, mMap):
+    def __init__(self, yi, mMap, geometryCache=None, stats=None, session=None):
         self.yi = yi
         self.materialMap = mMap
+        self.geometryCache = geometryCache
+        self.session = session
+        self.stats = stats if stats is not None else yaf_stats.yafExportStats(0)
+        self.strandStats = self.stats.hair
+        self.cameraView = None
+        self.culledInstances = 0
+        # names of the exported textures, identical textures share one
+        self.textureMap = {}
 
     def setScene(self, scene):
 
         self.scene = scene
+        # clay renders use one material without textures, so no orcos and uvs are needed
+        self.clay = scene.gs_clay_render
 
     def createCamera(self):
 
@@ -84,6 +98,13 @@ class yafObject(object):
 
         yi.paramsClearAll()
 
+        # camera settings for the export time camera view
+        viewType = "perspective"
+        viewFocal = 0.7
+        viewScale = 1.0
+        viewAngle = 90.0
+        viewMaxAngle = 90.0
+
         if bpy.types.YAFA_RENDER.useViewToRender:
             yi.paramsSetString("type", "perspective")
             yi.paramsSetFloat("focal", 0.7)
@@ -94,6 +115,7 @@ class yafObject(object):
             camType = camera.camera_type
 
             yi.paramsSetString("type", camType)
+            viewType = camType
 
             if camera.use_clipping:
                 yi.paramsSetFloat("nearClip", camera.clip_start)
@@ -101,6 +123,7 @@ class yafObject(object):
 
             if camType == "orthographic":
                 yi.paramsSetFloat("scale", camera.ortho_scale)
+                viewScale = camera.ortho_scale
 
             elif camType in {"perspective", "architect"}:
                 # Blenders GSOC 2011 project "tomato branch" merged into trunk.
@@ -120,7 +143,8 @@ class yafObject(object):
                 else:
                     f_aspect = x / y
 
-                yi.paramsSetFloat("focal", camera.lens / (f_aspect * sensor_size))
+                viewFocal = camera.lens / (f_aspect * sensor_size)
+                yi.paramsSetFloat("focal", viewFocal)
 
                 # DOF params, only valid for real camera
                 # use DOF object distance if present or fixed DOF
@@ -143,6 +167,8 @@ class yafObject(object):
                 yi.paramsSetBool("mirrored", camera.mirrored)
                 yi.paramsSetFloat("max_angle", camera.max_angle)
                 yi.paramsSetFloat("angle", camera.angular_angle)
+                viewAngle = camera.angular_angle
+                viewMaxAngle = camera.max_angle
 
         yi.paramsSetInt("resx", x)
         yi.paramsSetInt("resy", y)
@@ -152,6 +178,9 @@ class yafObject(object):
         yi.paramsSetPoint("to", to[0], to[1], to[2])
         yi.createCamera("cam")
 
+        if yaf_view.numpy is not None:
+            self.cameraView = yaf_view.yafCameraView(viewType, pos, to, up, x, y, viewFocal, viewScale, viewAngle, viewMaxAngle)
+
     def getBBCorners(self, object):
         bb = object.bound_box   # look bpy.types.Object if there is any problem
 
@@ -197,31 +226,176 @@ class yafObject(object):
         else:  # The rest of the object types
             self.writeMesh(obj, matrix)
 
-    def writeInstanceBase(self, obj):
+    def writeInstanceBase(self, obj, level=0):
 
         # Generate unique object ID
         ID = self.yi.getNextFreeID()
 
-        self.yi.printInfo("Exporting Base Mesh: {0} with ID: {1:d}".format(obj.name, ID))
+        if level:
+            self.yi.printInfo("Exporting Base Mesh: {0} with ID: {1:d}, level of detail {2:d}".format(obj.name, ID, level))
+        else:
+            self.yi.printInfo("Exporting Base Mesh: {0} with ID: {1:d}".format(obj.name, ID))
 
         obType = 512  # Create this geometry object as a base object for instances
 
-        self.writeGeometry(ID, obj, None, obType)  # We want the vertices in object space
+        self.writeGeometry(ID, obj, None, obType, level=level)  # We want the vertices in object space
 
         return ID
 
-    def writeInstance(self, oID, obj2WorldMatrix, name):
+    def writeInstances(self, oID, matrices, name):
+        # all instances of one base at once, 'matrices' are the object to world
+        # matrices as (N, 4, 4) array or as a list of 4x4 blender matrices
+        numInstances = len(matrices)
+        if not numInstances:
+            return
+
+        self.yi.printInfo("Exporting {0:d} Instances of {1} [ID = {2:d}]".format(numInstances, name, oID))
+
+        if self.session is not None:
+            rows = matrices.reshape(numInstances, 16).tolist() if not isinstance(matrices, list) else [[v for row in m for v in row] for m in matrices]
+            if self.session.instancesUnchanged(oID, rows):
+                return
+
+        # no yafrayinterface has addInstances() yet, the branch is inert until
+        # the interface adds it and the loop below uploads the instances
+        if yaf_geometry.numpy is not None and hasattr(self.yi, "addInstances"):
+            o2w = yaf_geometry.numpy.array([[list(row) for row in m] for m in matrices] if isinstance(matrices, list) else matrices, dtype=yaf_geometry.numpy.float32)
+            self.yi.addInstances(oID, o2w.reshape(numInstances, 16), numInstances)
+            return
+
+        if not isinstance(matrices, list):
+            matrices = matrices.tolist()
+
+        # addInstance() copies the matrix, so one matrix4x4_t serves all instances
+        o2w = yafrayinterface.matrix4x4_t()
+        setVal = o2w.setVal
+        addInstance = self.yi.addInstance
+
+        for matrix in matrices:
+            for i in range(4):
+                row = matrix[i]
+                for j in range(4):
+                    setVal(i, j, row[j])
+            addInstance(oID, o2w)
+
+    def getParticleInstanceMatrices(self, pSys):
+        # instance matrices of the dupli object of a particle system,
+        # following the dupli object options of the particle settings
+        settings = pSys.settings
+        dupli = settings.dupli_object
+        dupliMatrix = dupli.matrix_world
+
+        if settings.use_rotation_dupli:
+            objectMatrix = dupliMatrix.to_3x3()
+        else:
+            # particle rotation uses the x-axis as the aligned axis, so pre-rotate the object accordingly
+            axis = {'POS_X': 'X', 'POS_Y': 'Y', 'POS_Z': 'Z', 'NEG_X': '-X', 'NEG_Y': '-Y', 'NEG_Z': '-Z'}
+            objectMatrix = mathutils.Vector((-1.0, 0.0, 0.0)).to_track_quat(axis[dupli.track_axis], dupli.up_axis).to_matrix()
+
+        objectMatrix = yaf_geometry.numpy.array([list(row) for row in objectMatrix], dtype=yaf_geometry.numpy.float64)
+        if not settings.use_rotation_dupli and getattr(settings, "use_scale_dupli", False):
+            objectMatrix *= yaf_geometry.numpy.array(dupliMatrix.to_scale()[:])
+
+        offset = dupliMatrix.to_translation()[:] if settings.use_global_dupli else (0.0, 0.0, 0.0)
+
+        return yaf_geometry.getParticleMatrices(pSys, self.scene.frame_current, objectMatrix, offset)
+
+    def cullInstances(self, obj, matrices):
+        # drop the instances of obj (object to world matrices (N, 4, 4)) that
+        # can't be seen from the render camera, objects close to the camera
+        # are kept as they may still cast shadows or bounce light into view
+        scene = self.scene
+        if not scene.gs_cull_geometry or self.cameraView is None or not len(matrices):
+            return matrices
+
+        corners = yaf_geometry.worldCorners(obj, matrices)
+
+        keep = self.cameraView.inFrustum(corners, scene.gs_cull_margin)
+        if scene.gs_cull_keep_distance > 0 and scene.intg_light_method != 'Debug':
+            keep |= self.cameraView.withinDistance(corners, scene.gs_cull_keep_distance)
+
+        self.culledInstances += len(matrices) - int(keep.sum())
+        return matrices[keep]
+
+    def isCulled(self, obj, matrix=None):
+        if not self.scene.gs_cull_geometry or self.cameraView is None:
+            return False
+        if matrix is None:
+            matrix = obj.matrix_world
+        return not len(self.cullInstances(obj, yaf_geometry.matrixToArray(matrix)[None]))
+
+    def getDetailLevels(self, obj, matrices):
+        # level of detail of every instance of obj (object to world matrices
+        # (N, 4, 4)), one level down each time the size on screen halves
+        numpy = yaf_geometry.numpy
+        levels = numpy.zeros(len(matrices), dtype=int)
+        scene = self.scene
+
+        if not scene.gs_lod or self.cameraView is None or not len(matrices) or not yaf_geometry.hasDetailLevels(obj):
+            return levels
+
+        centers, radii = yaf_geometry.boundingSpheres(yaf_geometry.worldCorners(obj, matrices))
+        size = numpy.maximum(self.cameraView.pixelSize(centers, radii), 1e-6)
+        levels = numpy.ceil(numpy.log2(scene.gs_lod_pixels / size))
+
+        return numpy.clip(levels, 0, scene.gs_lod_levels).astype(int)
+
+    def writeInstancesLod(self, baseIds, name, obj, matrices):
+        # instances of obj, each one using the base with the level of detail
+        # for its size on screen. 'baseIds' holds the full detail base by name
+        # and the reduced ones by (name, level)
+        if yaf_geometry.numpy is None or not self.scene.gs_lod:
+            if name not in baseIds:
+                baseIds[name] = self.writeInstanceBase(obj)
+            self.writeInstances(baseIds[name], matrices, name)
+            return
+
+        if isinstance(matrices, list):
+            matrices = yaf_geometry.numpy.array([yaf_geometry.matrixToArray(m) for m in matrices])
+
+        levels = self.getDetailLevels(obj, matrices)
 
-        self.yi.printInfo("Exporting Instance of {0} [ID = {1:d}]".format(name, oID))
+        for level in sorted(set(levels.tolist())):
+            key = (name, level) if level else name
+            if key not in baseIds:
+                baseIds[key] = self.writeInstanceBase(obj, level)
+            self.writeInstances(baseIds[key], matrices[levels == level], name)
 
-        mat4 = obj2WorldMatrix.to_4x4()
-        # mat4.transpose() --> not needed anymore: matrix indexing changed with Blender rev.42816
+    def isPlainMesh(self, obj):
+        # objects that are exported by writeMesh() in writeObject()
+        return not (obj.vol_enable or obj.ml_enable or obj.bgp_enable or obj.particle_systems)
 
-        o2w = self.get4x4Matrix(mat4)
+    def writeAutoInstances(self, objects):
+        if yaf_geometry.numpy is None:
+            for obj in objects:
+                self.writeMesh(obj, obj.matrix_world.copy())
+            return
 
-        self.yi.addInstance(oID, o2w)
-        del mat4
-        del o2w
+        # group the objects by the content of their evaluated meshes,
+        # keep the scene order to get the same IDs on every export
+        groups = collections.OrderedDict()
+
+        for obj in objects:
+            buffers = self.getGeometryBuffers(obj, self.hasOrcoTexture(obj))
+            if buffers is None:
+                continue
+            materials = [ms.material.name if ms.material else None for ms in obj.material_slots]
+            key = yaf_geometry.contentFingerprint(buffers, materials)
+            if key not in groups:
+                groups[key] = (buffers, [])
+            groups[key][1].append(obj)
+
+        for buffers, objs in groups.values():
+            if len(objs) == 1:
+                obj = objs[0]
+                self.yi.printInfo("Exporting Mesh: {0}".format(obj.name))
+                ID = self.yi.getNextFreeID()
+                self.writeGeometry(ID, obj, obj.matrix_world.copy(), buffers=buffers)
+            else:
+                ID = self.yi.getNextFreeID()
+                self.yi.printInfo("Exporting Base Mesh: {0} with ID: {1:d}, shared by {2:d} identical meshes".format(objs[0].name, ID, len(objs)))
+                self.writeGeometry(ID, objs[0], None, 512, buffers=buffers)
+                self.writeInstances(ID, [obj.matrix_world.copy() for obj in objs], objs[0].name)
 
     def writeMesh(self, obj, matrix):
 
@@ -230,7 +404,11 @@ class yafObject(object):
         # Generate unique object ID
         ID = self.yi.getNextFreeID()
 
-        self.writeGeometry(ID, obj, matrix)  # obType in 0, default, the object is rendered
+        level = 0
+        if yaf_geometry.numpy is not None:
+            level = int(self.getDetailLevels(obj, yaf_geometry.matrixToArray(matrix)[None])[0])
+
+        self.writeGeometry(ID, obj, matrix, level=level)  # obType in 0, default, the object is rendered
 
     def writeBGPortal(self, obj, matrix):
 
@@ -316,7 +494,7 @@ class yafObject(object):
                 yi.paramsSetFloat("sharpness", obj.vol_sharpness)
                 yi.paramsSetFloat("cover", obj.vol_cover)
                 yi.paramsSetFloat("density", obj.vol_density)
-                yi.paramsSetString("texture", texture.name)
+                yi.paramsSetString("texture", self.textureMap.get(texture.name, texture.name))
 
         elif obj.vol_region == 'Grid Volume':
             yi.paramsSetString("type", "GridVolume")
@@ -344,40 +522,132 @@ class yafObject(object):
         yi.createVolumeRegion("VR.{0}-{1}".format(obj.name, str(obj.__hash__())))
         bpy.data.meshes.remove(mesh)
 
-    def writeGeometry(self, ID, obj, matrix, obType=0, oMat=None):
+    def hasOrcoTexture(self, obj):
+        # Check if the object has an orco mapped texture,
+        # material slots hold the same materials as the render mesh
+        if self.clay:
+            return False
+        for mat in [ms.material for ms in obj.material_slots if ms.material is not None]:
+            for m in [mtex for mtex in mat.texture_slots if mtex is not None]:
+                if m.texture_coords == 'ORCO':
+                    return True
+        return False
 
-        mesh = obj.to_mesh(self.scene, True, 'RENDER')
-        isSmooth = False
-        hasOrco = False
-        # test for UV Map after BMesh API changes
-        uv_texture = mesh.tessface_uv_textures if 'tessface_uv_textures' in dir(mesh) else mesh.uv_textures
+    def getRenderMesh(self, obj):
+
+        with self.stats.phase("to_mesh"):
+            mesh = obj.to_mesh(self.scene, True, 'RENDER')
         # test for faces after BMesh API changes
         face_attr = 'faces' if 'faces' in dir(mesh) else 'tessfaces'
-        hasUV = len(uv_texture) > 0  # check for UV's
 
         if face_attr == 'tessfaces':
             if not mesh.tessfaces and mesh.polygons:
                 # BMesh API update, check for tessellated faces, if needed calculate them...
                 mesh.update(calc_tessface=True)
 
-            if not mesh.tessfaces:
-                # if there are no faces, no need to write geometry, remove mesh data then...
-                bpy.data.meshes.remove(mesh)
+        if not getattr(mesh, face_attr):
+            # if there are no faces, no need to write geometry, remove mesh data then...
+            bpy.data.meshes.remove(mesh)
+            return None, face_attr
+
+        return mesh, face_attr
+
+    def hasUV(self, mesh):
+        if self.clay:
+            return False
+        # test for UV Map after BMesh API changes
+        uv_texture = mesh.tessface_uv_textures if 'tessface_uv_textures' in dir(mesh) else mesh.uv_textures
+        return len(uv_texture) > 0
+
+    def geometryKey(self, obj, hasOrco, level):
+        # clay buffers are without uvs
+        return (obj.name, hasOrco, level, self.clay)
+
+    def writeGeometry(self, ID, obj, matrix, obType=0, oMat=None, level=0, buffers=None):
+        # 'buffers' already prepared for obj are uploaded as they are
+        hasOrco = self.hasOrcoTexture(obj)
+
+        session = self.session
+        signature = None
+        if session is not None:
+            signature = self.geometrySignature(obj, matrix, obType, oMat, hasOrco, level)
+            if session.geometryUnchanged(ID, signature, session.isDirty(obj)):
                 return
+
+        written = False
+        if yaf_geometry.numpy is None:
+            mesh, face_attr = self.getRenderMesh(obj)
+            if mesh is not None:
+                self.writeGeometryPerElement(ID, obj, mesh, matrix, obType, oMat, hasOrco, face_attr)
+                bpy.data.meshes.remove(mesh)
+                written = True
+        else:
+            if buffers is None:
+                buffers = self.getGeometryBuffers(obj, hasOrco, level)
+            if buffers is not None:
+                self.uploadGeometry(ID, obj, buffers, matrix, obType, oMat)
+                written = True
+
+        if session is not None:
+            if not written and session.hasGeometry(ID):
+                # the interface can't remove objects, an empty mesh takes the place of the last one
+                yaf_geometry.uploadEmptyMesh(self.yi, ID, obType)
+            session.geometryWritten(ID, signature, written)
+
+    def geometrySignature(self, obj, matrix, obType, oMat, hasOrco, level):
+        # what the geometry of the object in the scene of the session depends on
+        palette = tuple(self.session.handleSerial(m) for m in self.getMaterialPalette(obj, oMat))
+        matrix = tuple(tuple(row) for row in matrix) if matrix is not None else None
+        return (yaf_geometry.geometryFingerprint(obj, self.scene.frame_current), matrix, obType, palette, hasOrco, level)
+
+    def getGeometryBuffers(self, obj, hasOrco, level=0):
+
+        cache = self.geometryCache
+
+        if cache is not None:
+            key = self.geometryKey(obj, hasOrco, level)
+            fingerprint = yaf_geometry.geometryFingerprint(obj, self.scene.frame_current)
+            entry = cache.lookup(key, fingerprint)
+            if entry is not None:
+                # unchanged since the last frame, skip to_mesh() and buffer extraction
+                return entry.buffers
+
+        buffers = None
+        if level:
+            # reduced from the full detail buffers, which are cached as well
+            buffers = yaf_geometry.reduceDetail(self.getGeometryBuffers(obj, hasOrco), level)
         else:
-            if not mesh.faces:
-                # if there are no faces, no need to write geometry, remove mesh data then...
+            mesh, face_attr = self.getRenderMesh(obj)
+            if mesh is not None:
+                bbox = self.getBBCorners(obj) if hasOrco else None
+                buffers = yaf_geometry.getMeshBuffers(obj, mesh, face_attr, hasOrco, self.hasUV(mesh), bbox)
                 bpy.data.meshes.remove(mesh)
-                return
 
-        # Check if the object has an orco mapped texture
-        for mat in [mmat for mmat in mesh.materials if mmat is not None]:
-            for m in [mtex for mtex in mat.texture_slots if mtex is not None]:
-                if m.texture_coords == 'ORCO':
-                    hasOrco = True
-                    break
-            if hasOrco:
-                break
+        if cache is not None:
+            cache.store(key, fingerprint, buffers)
+
+        return buffers
+
+    def getMaterialPalette(self, obj, oMat=None):
+        # materials for every mesh material index, the face material
+        # only depends on the index, so resolve it once per index
+        if oMat:
+            return [oMat]
+        # material slots resolve object linked materials like to_mesh() does
+        meshMats = [ms.material for ms in obj.material_slots]
+        return [self.getFaceMaterial(meshMats, index, obj.material_slots) for index in range(max(len(meshMats), 1))]
+
+    def uploadGeometry(self, ID, obj, buffers, matrix, obType=0, oMat=None):
+        # Transform the vertices only if matrix exists, orcos stay untransformed
+        co = yaf_geometry.transformPoints(buffers.co, matrix)
+        palette = self.getMaterialPalette(obj, oMat)
+        yaf_geometry.uploadTriMesh(self.yi, ID, buffers, co, palette, obType)
+
+    def writeGeometryPerElement(self, ID, obj, mesh, matrix, obType, oMat, hasOrco, face_attr):
+        isSmooth = False
+        # test for UV Map after BMesh API changes
+        uv_texture = mesh.tessface_uv_textures if 'tessface_uv_textures' in dir(mesh) else mesh.uv_textures
+        hasUV = self.hasUV(mesh)
 
         # normalized vertex positions for orco mapping
         ov = []
@@ -454,8 +724,6 @@ class yafObject(object):
 
         self.yi.endGeometry()
 
-        bpy.data.meshes.remove(mesh)
-
     def getFaceMaterial(self, meshMats, matIndex, matSlots):
 
         ymaterial = self.materialMap["default"]
@@ -503,27 +771,31 @@ class yafObject(object):
                         strandEnd = 0.01
                         strandShape = 0.0
 
-                    for particle in pSys.particles:
-                        if particle.is_exist and particle.is_visible:
-                            p = True
-                        else:
-                            p = False
-                        CID = yi.getNextFreeID()
-                        yi.paramsClearAll()
-                        yi.startGeometry()
-                        yi.startCurveMesh(CID, p)
-                        for location in particle.hair_keys:
-                            vertex = matrix * location.co  # use reverse vector multiply order, API changed with rev. 38674
-                            yi.addVertex(vertex[0], vertex[1], vertex[2])
-                        #this section will be changed after the material settings been exported
-                        if self.materialMap[pmaterial]:
-                            yi.endCurveMesh(self.materialMap[pmaterial], strandStart, strandEnd, strandShape)
-                        else:
-                            yi.endCurveMesh(self.materialMap["default"], strandStart, strandEnd, strandShape)
-                    # TODO: keep object smooth
-                    #yi.smoothMesh(0, 60.0)
-                        yi.endGeometry()
-                    yi.printInfo("Exporter: Particle creation time: {0:.3f}".format(time.time() - tstart))
+                    #this section will be changed after the material settings been exported
+                    if self.clay:
+                        ymaterial = self.materialMap["clay"]
+                    elif self.materialMap.get(pmaterial):
+                        ymaterial = self.materialMap[pmaterial]
+                    else:
+                        ymaterial = self.materialMap["default"]
+
+                    if yaf_geometry.numpy is None:
+                        numStrands, numKeys = self.writeStrandsPerParticle(pSys, matrix, ymaterial, strandStart, strandEnd, strandShape)
+                    else:
+                        # all hair keys of the system in one buffer, transformed at once
+                        strands = yaf_geometry.getStrandBuffers(pSys)
+                        strands.co = yaf_geometry.transformPoints(strands.co, matrix)
+                        widthScale = None
+                        if self.scene.gs_hair_lod and self.cameraView is not None:
+                            strands, widthScale = yaf_geometry.simplifyStrands(strands, self.cameraView, self.scene.gs_hair_lod_pixels,
+                                                                               self.scene.gs_hair_lod_min_density,
+                                                                               math.radians(self.scene.gs_hair_lod_curvature))
+                        yaf_geometry.uploadCurves(yi, strands, strands.co, ymaterial, strandStart, strandEnd, strandShape, widthScale)
+                        numStrands, numKeys = strands.numStrands(), strands.numKeys()
+
+                    tcreate = time.time() - tstart
+                    self.strandStats.append((object.name, pSys.name, numStrands, numKeys, tcreate))
+                    yi.printInfo("Exporter: Hair Particle System {!r}: {:d} strands, {:d} keys, creation time: {:.3f}s".format(pSys.name, numStrands, numKeys, tcreate))
 
                     if pSys.settings.use_render_emitter:
                         renderEmitter = True
@@ -534,3 +806,26 @@ class yafObject(object):
         if renderEmitter:
             # ymat = self.materialMap["default"]  /* UNUSED */
             self.writeMesh(object, matrix)
+
+    def writeStrandsPerParticle(self, pSys, matrix, ymaterial, strandStart, strandEnd, strandShape):
+
+        yi = self.yi
+        numKeys = 0
+
+        for particle in pSys.particles:
+            if particle.is_exist and particle.is_visible:
+                p = True
+            else:
+                p = False
+            CID = yi.getNextFreeID()
+            yi.paramsClearAll()
+            yi.startGeometry()
+            yi.startCurveMesh(CID, p)
+            for location in particle.hair_keys:
+                vertex = matrix * location.co  # use reverse vector multiply order, API changed with rev. 38674
+                yi.addVertex(vertex[0], vertex[1], vertex[2])
+                numKeys += 1
+            yi.endCurveMesh(ymaterial, strandStart, strandEnd, strandShape)
+            yi.endGeometry()
+
+        return len(pSys.particles), numKeys
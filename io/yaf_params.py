@@ -0,0 +1,79 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import yafrayinterface
+
+
+class yafParamsRecorder:
+    # Stands in for the interface while a material or texture is written. The
+    # params calls are only recorded, creating the element passes them on if
+    # none with the same parameters was created before and returns that one otherwise
+    def __init__(self, yi, known):
+        self.__dict__["_yi"] = yi
+        self.__dict__["_known"] = known
+        self.__dict__["calls"] = []
+        self.__dict__["alias"] = None
+
+    def __getattr__(self, name):
+        if not name.startswith("params"):
+            return getattr(self._yi, name)
+        calls = self.calls
+
+        def recordedCall(*args):
+            calls.append((name,) + args)
+
+        # look up every method only once
+        self.__dict__[name] = recordedCall
+        return recordedCall
+
+    def paramsSetMemMatrix(self, key, matrix, transpose):
+        # the caller frees the array right after the call
+        values = tuple(yafrayinterface.floatArray_getitem(matrix, i) for i in range(16))
+        self.calls.append(("paramsSetMemMatrix", key, values, transpose))
+
+    def replay(self):
+        yi = self._yi
+        for call in self.calls:
+            if call[0] == "paramsSetMemMatrix":
+                matrix = yafrayinterface.new_floatArray(4 * 4)
+                for i, value in enumerate(call[2]):
+                    yafrayinterface.floatArray_setitem(matrix, i, value)
+                yi.paramsSetMemMatrix(call[1], matrix, call[3])
+                yafrayinterface.delete_floatArray(matrix)
+            else:
+                getattr(yi, call[0])(*call[1:])
+
+    def createElement(self, call, name):
+        key = (call,) + tuple(self.calls)
+        known = self._known.get(key)
+        if known is not None:
+            self.__dict__["alias"] = known[0]
+            return known[1]
+
+        self.replay()
+        handle = getattr(self._yi, call)(name)
+        self._known[key] = (name, handle)
+        return handle
+
+    def createMaterial(self, name):
+        return self.createElement("createMaterial", name)
+
+    def createTexture(self, name):
+        return self.createElement("createTexture", name)
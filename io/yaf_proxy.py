@@ -0,0 +1,150 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import hashlib
+import os
+import struct
+import bpy
+from . import yaf_imagecache
+
+# high dynamic range images keep their range in the proxy
+PROXY_FORMATS = {
+    ".hdr": ('OPEN_EXR', ".exr"),
+    ".exr": ('OPEN_EXR', ".exr"),
+}
+
+# JPEG start of frame markers, the others don't hold the image size
+JPEG_SOF_MARKERS = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+
+
+def jpegSize(f):
+    f.seek(2)
+    while True:
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xff:
+            return None
+        length = struct.unpack(">H", marker[2:])[0]
+        if marker[1] in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">xHH", f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def hdrSize(f):
+    for i in range(64):
+        line = f.readline().strip()
+        if line.startswith((b"-Y", b"+Y")):
+            parts = line.split()
+            return int(parts[3]), int(parts[1])
+    return None
+
+
+def imageFileSize(path):
+    # width and height from the header of the image file, without loading
+    # the pixels, None for unknown formats
+    try:
+        with open(path, "rb") as f:
+            head = f.read(26)
+            extension = os.path.splitext(path)[1].lower()
+            if head.startswith(b"\x89PNG"):
+                return struct.unpack(">II", head[16:24])
+            if head.startswith(b"\xff\xd8"):
+                return jpegSize(f)
+            if head.startswith(b"BM"):
+                width, height = struct.unpack("<ii", head[18:26])
+                return width, abs(height)
+            if head.startswith(b"#?"):
+                f.seek(0)
+                return hdrSize(f)
+            if extension == ".tga":
+                return struct.unpack("<HH", head[12:16])
+    except (IOError, OSError, struct.error, ValueError, IndexError):
+        pass
+    return None
+
+
+def proxyPath(directory, path, maxSize):
+    # the proxy of the image file at 'path' as it is now, None if the file is missing
+    path = os.path.normpath(os.path.realpath(path))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    extension = PROXY_FORMATS.get(os.path.splitext(path)[1].lower(), ('PNG', ".png"))[1]
+    key = (path, stat.st_size, stat.st_mtime, maxSize)
+    return os.path.join(directory, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + extension)
+
+
+def needsProxy(image, path, maxSize):
+    # the size from the file header, blender only has to load images of unknown formats
+    size = imageFileSize(path) or tuple(image.size)
+    return max(size) > maxSize
+
+
+def makeProxy(image, path, directory, maxSize):
+    # Scales a copy of the image with blender and saves it as the proxy,
+    # adds and removes an image datablock, so only for the main thread.
+    # Returns the proxy path or None if the image needs no proxy
+    proxy = proxyPath(directory, path, maxSize)
+    if proxy is None or not needsProxy(image, path, maxSize):
+        return None
+    if yaf_imagecache.touch(proxy):
+        return proxy
+
+    copy = image.copy()
+    try:
+        # the copy reads the file, not the pixels painted in blender
+        copy.filepath_raw = path
+        width, height = copy.size
+        scale = float(maxSize) / max(width, height, 1)
+        copy.scale(max(int(width * scale + 0.5), 1), max(int(height * scale + 0.5), 1))
+        fileformat, extension = PROXY_FORMATS.get(os.path.splitext(path)[1].lower(), ('PNG', ".png"))
+        temp = os.path.splitext(proxy)[0] + ".part" + extension
+        copy.filepath_raw = temp
+        copy.file_format = fileformat
+        copy.save()
+        os.replace(temp, proxy)
+    finally:
+        bpy.data.images.remove(copy)
+    return proxy
+
+
+class yafTextureProxies:
+    # Downscaled copies of the image files of textures, looked up in the
+    # image cache directory under the path and modification time of the
+    # original. The export only looks the proxies up, they are made on the
+    # main thread by the texture proxies operator, which also keeps the cache
+    # within its size limit
+    def __init__(self, directory, maxSize):
+        self.directory = yaf_imagecache.cacheDirectory(directory, "proxies", create=False)
+        self.maxSize = maxSize
+        self.used = 0
+        self.missing = 0
+
+    def getProxy(self, path):
+        # path of the image file to load instead of 'path'
+        proxy = proxyPath(self.directory, path, self.maxSize)
+        if proxy is not None and yaf_imagecache.touch(proxy):
+            self.used += 1
+            return proxy
+        size = imageFileSize(path)
+        if size is None or max(size) > self.maxSize:
+            self.missing += 1
+        return path
@@ -25,7 +25,7 @@ def computeSceneSize(render):
     return [sizeX, sizeY]
 
 
-def getRenderCoords(scene):
+def getRenderCoords(scene, index=None):
     render = scene.render
     [sizeX, sizeY] = computeSceneSize(render)
 
@@ -36,7 +36,10 @@ def getRenderCoords(scene):
 
     cam_data = None
 
-    if scene.objects:
+    if index is not None:
+        if index.camera is not None:
+            cam_data = index.camera.data
+    elif scene.objects:
         for item in scene.objects:
             if item.type == 'CAMERA':
                 cam_data = item.data
@@ -81,12 +84,12 @@ def exportAA(yi, scene):
     yi.paramsSetString("filter_type", scene.AA_filter_type)
 
 
-def exportRenderSettings(yi, scene):
+def exportRenderSettings(yi, scene, index=None):
     yi.printInfo("Exporting Render Settings")
 
     render = scene.render
 
-    [sizeX, sizeY, bStartX, bStartY, bsizeX, bsizeY, cam_data] = getRenderCoords(scene)
+    [sizeX, sizeY, bStartX, bStartY, bsizeX, bsizeY, cam_data] = getRenderCoords(scene, index)
 
     yi.paramsSetString("camera_name", "cam")
     yi.paramsSetString("integrator_name", "default")
@@ -0,0 +1,374 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import bpy
+import collections
+import yafrayinterface
+from bpy.app.handlers import persistent
+
+# Scene elements that can be replaced by creating them again under a new
+# name, the parameters below refer to them by name and get renamed too
+VERSIONED_CALLS = {"createTexture", "createMaterial", "createCamera", "createBackground",
+                   "createIntegrator", "createImageHandler"}
+# parameter -> create call of the elements it refers to
+REFERENCE_PARAMS = {
+    "texture": "createTexture",
+    "material1": "createMaterial",
+    "material2": "createMaterial",
+    "camera_name": "createCamera",
+    "integrator_name": "createIntegrator",
+    "volintegrator_name": "createIntegrator",
+    "background_name": "createBackground",
+}
+
+# Scene elements the interface can't replace or remove, any change needs a new scene
+FIXED_CALLS = {"createLight", "createVolumeRegion"}
+
+# Datablocks whose changes are tracked between the exports, edits of
+# mesh data or image pixels don't show up in the exported parameters
+DIRTY_COLLECTIONS = ("objects", "meshes", "curves", "metaballs", "materials", "textures", "images", "lamps", "worlds")
+DATA_COLLECTIONS = {'MESH': "meshes", 'CURVE': "curves", 'SURFACE': "curves", 'FONT': "curves", 'META': "metaballs"}
+
+
+class yafSessionRebuild(Exception):
+    # The changes of the frame can't be applied to the running session
+    pass
+
+
+class yafSession:
+    # An interface kept alive over the frames of an animation render,
+    # together with what has been exported into it. Without 'track' the
+    # changes aren't followed and everything counts as changed every frame
+    def __init__(self, yi, sceneName, track=True):
+        self.yi = yi
+        self.sceneName = sceneName
+        self.frames = 0
+        # (collection, name) of the datablocks changed since the last frame
+        self.changed = None
+        if track:
+            self.changed = set()
+            addSession(self)
+
+        # (create call, name) -> [parameter fingerprint, handle, version]
+        self.elements = {}
+        # (create call, name) -> current name of the elements created again
+        self.aliases = {}
+        # handles keep their serials, so materials can be compared over the frames
+        self.serials = {}
+        self.handles = []
+
+        # object IDs in allocation order, (geometry signature, uploaded) per ID,
+        # instances (base ID, matrix) in submission order
+        self.ids = []
+        self.geometry = {}
+        self.instances = []
+        # what the scene of the last frame can't take changes of, see layoutChanged()
+        self.layout = None
+
+    def beginFrame(self):
+        self.frames += 1
+        self.nextID = 0
+        self.nextInstance = 0
+        self.seen = set()
+        self.updates = collections.Counter()
+        self.dirty = self.changed
+        if self.changed is not None:
+            self.changed = set()
+
+        # image textures of changed images are created again, untracked
+        # sessions only know about the pixels changed in blender
+        self.stale = set()
+        for tex in bpy.data.textures:
+            image = getattr(tex, "image", None)
+            if image is None:
+                continue
+            if self.dirty is None:
+                changed = image.is_dirty or image.source == 'GENERATED'
+            else:
+                changed = ("images", image.name) in self.dirty
+            if changed:
+                self.stale.add(("createTexture", tex.name))
+
+    def isDirty(self, obj):
+        # the object, its data or the objects its modifiers use were changed
+        dirty = self.dirty
+        if dirty is None:
+            return True
+        if not dirty:
+            return False
+        if ("objects", obj.name) in dirty:
+            return True
+        if obj.data is not None and (DATA_COLLECTIONS.get(obj.type), obj.data.name) in dirty:
+            return True
+        for mod in obj.modifiers:
+            for prop in mod.bl_rna.properties:
+                if prop.type == 'POINTER' and prop.identifier != "rna_type":
+                    value = getattr(mod, prop.identifier, None)
+                    if isinstance(value, bpy.types.Object) and ("objects", value.name) in dirty:
+                        return True
+        return False
+
+    def endFrame(self):
+        if self.nextID < len(self.ids):
+            raise yafSessionRebuild("objects were removed")
+        if self.nextInstance < len(self.instances):
+            raise yafSessionRebuild("instances were removed")
+        for key in self.elements:
+            if key[0] in FIXED_CALLS and key not in self.seen:
+                raise yafSessionRebuild("{0} was removed".format(key[1]))
+
+    def layoutChanged(self, layout, changed=()):
+        # Compares the lights, volumes and instances of the frame, as given by
+        # the exporter, with the last frame. Returns why the frame needs a new
+        # scene or None, endFrame() still catches what isn't covered here
+        last = self.layout
+        self.layout = layout
+        if last is None:
+            return None
+        for name in changed:
+            if name in last:
+                return "the instances of {0} changed".format(name)
+        for name, state in last.items():
+            if name not in layout:
+                return "{0} was removed".format(name or "the camera")
+            if layout[name] != state:
+                return "{0} changed".format(name or "the camera")
+        return None
+
+    def handleSerial(self, handle):
+        return self.serials.get(id(handle))
+
+    def addHandle(self, handle):
+        # keep the handle alive, so its id() stays unique
+        self.serials[id(handle)] = len(self.handles)
+        self.handles.append(handle)
+
+    def geometryUnchanged(self, ID, signature, dirty=False):
+        if self.frames > 1 and not dirty and ID in self.geometry and self.geometry[ID][0] == signature:
+            self.updates["unchanged geometry"] += 1
+            return True
+        return False
+
+    def geometryWritten(self, ID, signature, uploaded):
+        # only recorded once the geometry is in the scene, 'uploaded' is
+        # False for objects without a mesh
+        self.geometry[ID] = (signature, uploaded)
+        self.updates["geometry"] += 1
+
+    def hasGeometry(self, ID):
+        return ID in self.geometry and self.geometry[ID][1]
+
+    def instancesUnchanged(self, baseID, matrices):
+        # 'matrices' as rows of 16 values, instances can't be moved or
+        # removed, so only new instances at the end are submitted
+        start = self.nextInstance
+        instances = [(baseID, tuple(m)) for m in matrices]
+        known = self.instances[start:start + len(instances)]
+        self.nextInstance += len(instances)
+
+        if not known:
+            self.instances.extend(instances)
+            self.updates["instances"] += len(instances)
+            return False
+        if known != instances:
+            raise yafSessionRebuild("instances changed")
+        return True
+
+    def interface(self):
+        return yafSessionInterface(self)
+
+    def close(self):
+        self.yi.clearAll()
+        removeSession(self)
+
+
+class yafSessionInterface:
+    # Stands in for the interface of a session: elements that didn't change
+    # since the last frame aren't created again, changed ones are created under
+    # a new name and object IDs are handed out in the same order every frame
+    def __init__(self, session):
+        self.__dict__["_session"] = session
+        self.__dict__["_yi"] = session.yi
+        self.__dict__["_params"] = []
+
+    def __getattr__(self, name):
+        attr = getattr(self._yi, name)
+
+        if name in VERSIONED_CALLS or name in FIXED_CALLS:
+            attr = self.createElement(name, attr)
+        elif name.startswith("params") and name != "paramsClearAll":
+            attr = self.recordParams(name, attr)
+
+        # look up every method only once
+        self.__dict__[name] = attr
+        return attr
+
+    def __setattr__(self, name, value):
+        setattr(self._yi, name, value)
+
+    def paramsClearAll(self):
+        del self._params[:]
+        self._yi.paramsClearAll()
+
+    def paramsSetString(self, key, value):
+        call = REFERENCE_PARAMS.get(key)
+        if call is not None:
+            value = self._session.aliases.get((call, value), value)
+        self._params.append(("paramsSetString", key, value))
+        self._yi.paramsSetString(key, value)
+
+    def paramsSetMemMatrix(self, key, matrix, transpose):
+        # the array is allocated for every call, the element is compared by the values
+        values = tuple(yafrayinterface.floatArray_getitem(matrix, i) for i in range(16))
+        self._params.append(("paramsSetMemMatrix", key, values, transpose))
+        self._yi.paramsSetMemMatrix(key, matrix, transpose)
+
+    def recordParams(self, name, method):
+        params = self._params
+
+        def recordedCall(*args):
+            params.append((name,) + args)
+            return method(*args)
+
+        return recordedCall
+
+    def createElement(self, call, method):
+        session = self._session
+        params = self._params
+
+        def createCall(name, *args):
+            key = (call, name)
+            fingerprint = hash(tuple(params) + args)
+            element = session.elements.get(key)
+            session.seen.add(key)
+
+            if element is not None and element[0] == fingerprint and key not in session.stale:
+                return element[1]
+
+            if element is None:
+                version = 0
+                currentName = name
+            elif call in FIXED_CALLS:
+                raise yafSessionRebuild("{0} changed".format(name))
+            else:
+                version = element[2] + 1
+                currentName = "{0}.v{1:d}".format(name, version)
+                session.aliases[key] = currentName
+
+            handle = method(currentName, *args)
+            session.elements[key] = [fingerprint, handle, version]
+            session.addHandle(handle)
+            session.updates[call] += 1
+            return handle
+
+        return createCall
+
+    def getNextFreeID(self):
+        session = self._session
+        if session.nextID == len(session.ids):
+            session.ids.append(self._yi.getNextFreeID())
+        ID = session.ids[session.nextID]
+        session.nextID += 1
+        return ID
+
+
+# the session of the running animation render or of the interactive renders
+session = None
+
+# sessions following the changes, the scene update handler is only installed while there are any
+liveSessions = []
+
+
+def addSession(newSession):
+    liveSessions.append(newSession)
+    if sceneUpdateHandler not in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.append(sceneUpdateHandler)
+
+
+def removeSession(oldSession):
+    if oldSession in liveSessions:
+        liveSessions.remove(oldSession)
+    if not liveSessions and sceneUpdateHandler in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.remove(sceneUpdateHandler)
+
+
+def collectUpdates():
+    # called after every scene update, the update flags only last until the next one
+    changed = []
+    for attr in DIRTY_COLLECTIONS:
+        blocks = getattr(bpy.data, attr, None)
+        if blocks is None or not blocks.is_updated:
+            continue
+        for block in blocks:
+            # object transforms are part of the exported matrices
+            if block.is_updated_data if attr == "objects" else block.is_updated:
+                changed.append((attr, block.name))
+    if changed:
+        for liveSession in liveSessions:
+            liveSession.changed.update(changed)
+
+
+@persistent
+def sceneUpdateHandler(scene):
+    # remember the changed datablocks for the next frame of the sessions
+    collectUpdates()
+
+
+def getSession(createInterface, sceneName, newSession):
+    # returns the running session or starts a new one on a new interface
+    global session
+    if newSession or session is None or session.sceneName != sceneName:
+        endSession()
+        session = yafSession(createInterface(), sceneName)
+    return session
+
+
+def endSession():
+    global session
+    if session is not None:
+        session.close()
+        session = None
+
+
+# idle sessions with the preview scene, previews may render at the same
+# time, so every preview render takes its own session out of the pool.
+# They don't track changes, nothing would be collected while they are idle
+previewPool = []
+PREVIEW_POOL_SIZE = 2
+# previewed materials pile up in the interface, start over after that many
+PREVIEW_SESSION_ELEMENTS = 500
+
+
+def acquirePreviewSession(createInterface, newSession):
+    if previewPool and not newSession:
+        return previewPool.pop()
+    return yafSession(createInterface(), "preview", False)
+
+
+def releasePreviewSession(previewSession):
+    if len(previewPool) < PREVIEW_POOL_SIZE and len(previewSession.handles) < PREVIEW_SESSION_ELEMENTS:
+        previewPool.append(previewSession)
+    else:
+        previewSession.close()
+
+
+def clearPreviewPool():
+    while previewPool:
+        previewPool.pop().close()
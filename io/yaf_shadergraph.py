@@ -0,0 +1,187 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import collections
+
+# color blend modes of the layer node that can be applied to a constant base color
+FOLDED_BLEND_MODES = {
+    'MIX': lambda base, col, f: f * col + (1.0 - f) * base,
+    'ADD': lambda base, col, f: f * col + base,
+    'MULTIPLY': lambda base, col, f: (1.0 - f + f * col) * base,
+    'SUBTRACT': lambda base, col, f: base - f * col,
+    'SCREEN': lambda base, col, f: 1.0 - (1.0 - f + f * (1.0 - col)) * (1.0 - base),
+}
+
+
+def mapperKey(mtex, textureName, preview):
+    # everything writeMappingNode() takes from the texture slot, with the
+    # name of the texture the renderer knows
+    obj = mtex.object
+    transform = tuple(tuple(row) for row in obj.matrix_world) if obj else None
+    bump = mtex.normal_factor if mtex.use_map_normal else None
+    return (textureName, mtex.texture_coords, transform, mtex.mapping_x, mtex.mapping_y, mtex.mapping_z,
+            mtex.mapping, tuple(mtex.offset), tuple(mtex.scale), bump, preview)
+
+
+def isColored(tex):
+    # same as the color_input of writeTexLayer()
+    return tex.yaf_tex_type == 'IMAGE' or (tex.yaf_tex_type == 'VORONOI' and tex.color_mode not in 'INTENSITY')
+
+
+def usesAlpha(tex):
+    return tex.yaf_tex_type == 'IMAGE' and tex.yaf_use_alpha and not tex.use_calculate_alpha
+
+
+def constantColor(tex, gamma):
+    # linear RGBA of image textures with the same color everywhere, None for all others
+    image = tex.image if tex.yaf_tex_type == 'IMAGE' else None
+    if image is None or image.source != 'GENERATED' or image.generated_type != 'BLANK':
+        return None
+    # painted images differ from their settings
+    if image.is_dirty:
+        return None
+    # clipped and checkered images are black around the tiles
+    if tex.extension not in {'REPEAT', 'EXTEND'} or tex.use_calculate_alpha or tex.yaf_is_normal_map:
+        return None
+    color = image.generated_color
+    # the texture of the saved image is linearized with the input gamma
+    return [max(c, 0.0) ** gamma for c in color[:3]] + [color[3]]
+
+
+class yafShaderLayer:
+    def __init__(self, name, slot, mtex, factor):
+        self.name = name
+        self.slot = slot
+        self.mtex = mtex
+        self.factor = factor
+        self.mapper = None
+        self.upper = ""
+
+
+class yafShaderChannel:
+    # The texture layers of one material input from the bottom up, 'base'
+    # is the value of the material the lowest layer is applied to
+    def __init__(self, param, base):
+        self.param = param
+        self.base = list(base)
+        self.layers = []
+        # textures were mapped to the input, even if no layer is left
+        self.mapped = False
+
+    @property
+    def isColor(self):
+        return len(self.base) >= 3
+
+    @property
+    def root(self):
+        return self.layers[-1].name if self.layers else ""
+
+
+class yafShaderGraph:
+    # The shader nodes of a material before they are written: layers of the
+    # channels and the texture mappers they read from. 'textureMap' holds the
+    # created textures with the names of identical ones they are shared with
+    def __init__(self, textureMap, preview=False, gamma=1.0):
+        self.textureMap = textureMap
+        self.preview = preview
+        self.gamma = gamma
+        self.channels = collections.OrderedDict()
+        # mapper key -> (name, texture slot)
+        self.mappers = collections.OrderedDict()
+        self.slots = set()
+        self.removed = 0
+
+    def addChannel(self, param, layerPrefix, mat, channelFlag, base, factorAttr):
+        # the layers of the texture slots that map to the material input 'param'
+        channel = yafShaderChannel(param, base)
+        self.channels[param] = channel
+
+        for i, mtex in enumerate(mat.texture_slots):
+            if not (mtex and mtex.use and mtex.texture) or mtex.texture.type == 'NONE':
+                continue
+            if not getattr(mtex, channelFlag) or mtex.texture.name not in self.textureMap:
+                continue
+            channel.mapped = True
+            factor = getattr(mtex, factorAttr)
+            # a layer without influence, stencils still mask the layers above
+            if factor == 0 and not mtex.use_stencil:
+                self.removed += 1
+                continue
+            if self.coversLayers(channel, mtex, factor):
+                self.removed += len(channel.layers)
+                del channel.layers[:]
+            channel.layers.append(yafShaderLayer("{0}{1:x}".format(layerPrefix, i), i, mtex, factor))
+
+        self.foldConstants(channel)
+
+        for i, layer in enumerate(channel.layers):
+            layer.upper = channel.layers[i - 1].name if i else ""
+            layer.mapper = self.getMapper(layer)
+
+        return channel
+
+    def coversLayers(self, channel, mtex, factor):
+        # an opaque color texture mixed in at full strength hides the layers below
+        if not channel.layers or not channel.isColor:
+            return False
+        if mtex.blend_type != 'MIX' or abs(factor) < 1.0 or mtex.use_stencil or mtex.use_rgb_to_intensity:
+            return False
+        if not isColored(mtex.texture) or usesAlpha(mtex.texture):
+            return False
+        return not any(layer.mtex.use_stencil for layer in channel.layers)
+
+    def foldConstants(self, channel):
+        # layers of constant textures at the bottom become part of the base color
+        while channel.layers and channel.isColor:
+            layer = channel.layers[0]
+            mtex = layer.mtex
+            blend = FOLDED_BLEND_MODES.get(mtex.blend_type)
+            color = constantColor(mtex.texture, self.gamma)
+            # with 'use_rgb_to_intensity' the slot color is blended, weighted by the texture intensity
+            if blend is None or color is None or mtex.use_stencil or mtex.use_rgb_to_intensity:
+                return
+
+            f = abs(layer.factor)
+            if usesAlpha(mtex.texture):
+                f *= color[3]
+            if mtex.invert or layer.factor < 0:
+                color = [1.0 - c for c in color]
+
+            channel.base = [max(blend(b, c, f), 0.0) for b, c in zip(channel.base[:3], color[:3])]
+            del channel.layers[0]
+            self.removed += 1
+
+    def getMapper(self, layer):
+        # slots with the same texture and mapping share one mapper
+        self.slots.add(layer.slot)
+        key = mapperKey(layer.mtex, self.textureMap[layer.mtex.texture.name], self.preview)
+        if key not in self.mappers:
+            self.mappers[key] = ("map{0:x}".format(len(self.mappers)), layer.mtex)
+        return self.mappers[key][0]
+
+    def removedNodes(self):
+        # every slot with layers used to get its own mapper
+        return self.removed + len(self.slots) - len(self.mappers)
+
+    def base(self, param):
+        return self.channels[param].base
+
+    def root(self, param):
+        return self.channels[param].root
@@ -0,0 +1,129 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import collections
+import contextlib
+import json
+import time
+
+# interface calls counted by yafCountingInterface, by name prefix
+COUNTED_CALLS = ("paramsSet", "addVertex", "addVertices", "addUV", "addTriangle", "addInstance", "addCurves")
+
+# seconds the last export of a scene spent on materials and textures,
+# clay renders of the scene report them as saved
+materialTimes = {}
+
+
+class yafCountingInterface:
+    # Stands in for the yafaray interface and counts the calls of the
+    # COUNTED_CALLS methods, everything else is passed through untouched
+    def __init__(self, yi, calls):
+        self.__dict__["_yi"] = yi
+        self.__dict__["_calls"] = calls
+
+    def __getattr__(self, name):
+        attr = getattr(self._yi, name)
+
+        if name.startswith(COUNTED_CALLS) and callable(attr):
+            attr = self.countCalls(name, attr)
+
+        # look up every method only once
+        self.__dict__[name] = attr
+        return attr
+
+    def countCalls(self, name, method):
+        calls = self._calls
+
+        def countedCall(*args):
+            calls[name] += 1
+            return method(*args)
+
+        return countedCall
+
+    def __setattr__(self, name, value):
+        setattr(self._yi, name, value)
+
+
+class yafExportStats:
+    # Wall times of the export phases and objects plus interface call
+    # counts of one exported frame
+    def __init__(self, frame):
+        self.frame = frame
+        self.phases = collections.OrderedDict()
+        self.objects = collections.OrderedDict()
+        self.calls = collections.Counter()
+        self.counters = collections.OrderedDict()
+        self.hair = []
+        # time spent in the phases inside each running phase
+        self.innerTimes = []
+        # seconds from the start of the render to the first pixel, the end or the abort
+        self.render = collections.OrderedDict()
+
+    def wrapInterface(self, yi):
+        return yafCountingInterface(yi, self.calls)
+
+    def addTime(self, table, name, seconds):
+        table[name] = table.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # phases can be nested, a phase only gets the time not spent in the
+        # phases inside it, so the phases add up to the total
+        start = time.time()
+        self.innerTimes.append(0.0)
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            self.addTime(self.phases, name, seconds - self.innerTimes.pop())
+            if self.innerTimes:
+                self.innerTimes[-1] += seconds
+
+    @contextlib.contextmanager
+    def object(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.addTime(self.objects, name, time.time() - start)
+
+    def summary(self):
+        phases = ", ".join("{0} {1:.2f}s".format(name, seconds) for name, seconds in self.phases.items())
+        calls = sum(self.calls.values())
+        return "Export: {0} | {1:d} interface calls".format(phases, calls)
+
+    def renderSummary(self):
+        return "Render: " + ", ".join("{0} {1:.3f}s".format(name, seconds) for name, seconds in self.render.items())
+
+    def report(self):
+        slowest = sorted(self.objects.items(), key=lambda item: item[1], reverse=True)
+        return collections.OrderedDict((
+            ("frame", self.frame),
+            ("phases", self.phases),
+            ("calls", collections.OrderedDict(sorted(self.calls.items()))),
+            ("counters", self.counters),
+            ("render", self.render),
+            ("objects", collections.OrderedDict(slowest)),
+            ("hair", [{"object": h[0], "system": h[1], "strands": h[2], "keys": h[3], "time": h[4]} for h in self.hair]),
+        ))
+
+    def writeReport(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
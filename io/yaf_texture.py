@@ -19,8 +19,10 @@
 # <pep8 compliant>
 
 import bpy
+import hashlib
 import os
 from bpy.path import abspath, clean_name
+from .yaf_params import yafParamsRecorder
 
 
 def noise2string(ntype):
@@ -40,10 +42,51 @@ def noise2string(ntype):
     return a.get(ntype, 'newperlin')
 
 
+def imageMemory(image):
+    # bytes of the image in the renderer, images blender hasn't loaded
+    # are estimated from their file instead of loading them for that
+    if getattr(image, "has_data", False):
+        width, height = image.size
+        return width * height * image.channels * (4 if image.is_float else 1)
+    if image.packed_file:
+        return image.packed_file.size
+    try:
+        return os.path.getsize(abspath(image.filepath, library=image.library))
+    except OSError:
+        return 0
+
+
+def imageContentKey(image, imageCache=None):
+    # identifies the pixels of an image: files by path, size and modification
+    # time, packed images by their data, other images by the datablock
+    if image.source == 'FILE' and image.packed_file:
+        if imageCache is not None and imageCache.handles(image):
+            # hashed by the cache anyway
+            return ("packed", imageCache.packedDigest(image))
+        data = getattr(image.packed_file, "data", None)
+        if data:
+            return ("packed", hashlib.sha1(data).hexdigest())
+    elif image.source == 'FILE':
+        path = os.path.realpath(abspath(image.filepath, library=image.library))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return ("file", path)
+        return ("file", path, stat.st_size, stat.st_mtime)
+    return ("image", image.name, image.library.filepath if image.library else None)
+
+
 class yafTexture:
     def __init__(self, interface):
         self.yi = interface
-        self.loadedTextures = set()
+        # texture name -> name of the identical texture created
+        self.loadedTextures = {}
+        # recorded params -> (name, texture), image content -> file given to the renderer
+        self.fingerprints = {}
+        self.imageFiles = {}
+        self.sharedTextures = 0
+        self.imageCache = None
+        self.proxies = None
 
     def writeTexture(self, scene, tex):
         name = tex.name
@@ -51,6 +94,24 @@ class yafTexture:
         if name in self.loadedTextures:
             return
 
+        yi = self.yi
+        recorder = self.yi = yafParamsRecorder(yi, self.fingerprints)
+        try:
+            textureConfigured = self.writeTextureParams(scene, tex)
+        finally:
+            self.yi = yi
+
+        if textureConfigured:
+            self.loadedTextures[name] = recorder.alias or name
+            if recorder.alias is not None:
+                # the renderer decodes an image only once
+                yi.printInfo("Exporter: Texture '{0}' is identical to '{1}'".format(name, recorder.alias))
+                self.sharedTextures += 1
+
+        return textureConfigured
+
+    def writeTextureParams(self, scene, tex):
+        name = tex.name
         yi = self.yi
         yi.paramsClearAll()
 
@@ -283,12 +344,20 @@ class yafTexture:
             fileformat = scene.render.image_settings.file_format.lower()
             extract_path = os.path.join(filename, "{:05d}".format(scene.frame_current))
 
-            if tex.image.source == 'GENERATED':
+            contentKey = imageContentKey(tex.image, self.imageCache)
+
+            if contentKey in self.imageFiles:
+                # the same image is already saved or found for another texture
+                image_tex = self.imageFiles[contentKey]
+            elif self.imageCache is not None and self.imageCache.handles(tex.image):
+                # extracted only when the cache has no image with the same content
+                image_tex = self.imageCache.extract(tex.image, scene, fileformat)
+            elif tex.image.source == 'GENERATED':
                 image_tex = "yaf_baked_image_{0}.{1}".format(clean_name(tex.name), fileformat)
                 image_tex = os.path.join(save_dir, extract_path, image_tex)
                 image_tex = abspath(image_tex)
                 tex.image.save_render(image_tex, scene)
-            if tex.image.source == 'FILE':
+            elif tex.image.source == 'FILE':
                 if tex.image.packed_file:
                     image_tex = "yaf_extracted_image_{0}.{1}".format(clean_name(tex.name), fileformat)
                     image_tex = os.path.join(save_dir, extract_path, image_tex)
@@ -302,9 +371,12 @@ class yafTexture:
                     if not os.path.exists(image_tex):
                         yi.printError("Exporter: Image texture {0} not found on: {1}".format(tex.name, image_tex))
                         return False
+                    if self.proxies is not None:
+                        image_tex = self.proxies.getProxy(image_tex)
 
             image_tex = os.path.realpath(image_tex)
             image_tex = os.path.normpath(image_tex)
+            self.imageFiles[contentKey] = image_tex
 
             yi.printInfo("Exporter: Creating Texture: '{0}' type {1}: {2}".format(name, tex.yaf_tex_type, image_tex))
 
@@ -352,6 +424,5 @@ class yafTexture:
 
         if textureConfigured:
             yi.createTexture(name)
-            self.loadedTextures.add(name)
 
         return textureConfigured
@@ -0,0 +1,121 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import math
+from .yaf_geometry import numpy, boundingSpheres
+
+
+class yafCameraView:
+    # The render camera as exported by yafObject.createCamera(), used to
+    # estimate the size of geometry on screen at export time
+    def __init__(self, camType, pos, to, up, resx, resy, focal=1.0, scale=1.0, angle=90.0, maxAngle=90.0):
+        self.camType = camType
+        self.resx = resx
+        self.resy = resy
+        self.focal = focal
+        self.scale = scale
+
+        self.pos = numpy.array(pos[:3], dtype=numpy.float64)
+        self.dir = numpy.array(to[:3], dtype=numpy.float64) - self.pos
+        self.dir /= max(numpy.linalg.norm(self.dir), 1e-10)
+
+        # 'up' is a point above the camera like the camera parameter
+        self.right = numpy.cross(self.dir, numpy.array(up[:3], dtype=numpy.float64) - self.pos)
+        self.right /= max(numpy.linalg.norm(self.right), 1e-10)
+        self.up = numpy.cross(self.right, self.dir)
+
+        # half size of the image plane at unit depth, or at the camera for orthographic cameras
+        aspect = resy / max(resx, 1)
+        if camType == "orthographic":
+            self.halfWidth = 0.5 * scale
+        else:
+            self.halfWidth = 0.5 / max(focal, 1e-10)
+        self.halfHeight = self.halfWidth * aspect
+
+        if camType == "angular":
+            # treat the angular camera like a wide perspective camera
+            self.focal = 0.5 / math.tan(math.radians(min(max(angle, 1.0), 179.0)) * 0.5)
+            # 'angle' is reached at the sides of the frame, the corners see further,
+            # rays beyond 'maxAngle' aren't traced
+            self.coneAngle = math.radians(min(angle * math.sqrt(1.0 + aspect * aspect), maxAngle))
+
+    def depth(self, points):
+        # distance of the points along the view direction
+        return numpy.dot(numpy.asarray(points, dtype=numpy.float64) - self.pos, self.dir)
+
+    def pixelsPerUnit(self, points):
+        # size of one blender unit in pixels at the given points
+        points = numpy.asarray(points, dtype=numpy.float64)
+        res = max(self.resx, self.resy)
+        if self.camType == "orthographic":
+            return numpy.full(len(points), res / max(self.scale, 1e-10))
+        depth = numpy.abs(self.depth(points))
+        if self.camType == "angular":
+            # angular cameras see all around, use the distance instead of the depth
+            depth = numpy.linalg.norm(points - self.pos, axis=1)
+        return res * self.focal / numpy.maximum(depth, 1e-6)
+
+    def pixelSize(self, centers, radii):
+        # projected diameter in pixels of spheres around the given centers
+        return 2 * numpy.asarray(radii, dtype=numpy.float64) * self.pixelsPerUnit(centers)
+
+    def inFrustum(self, corners, margin=0.0):
+        # 'corners' are the world space bounding box corners (N, M, 3) of N objects,
+        # an object is outside if all its corners are outside of one frustum plane.
+        # 'margin' widens the frustum relative to the frame size
+        corners = numpy.asarray(corners, dtype=numpy.float64) - self.pos
+
+        if self.camType == "angular":
+            return self.inCone(corners, margin)
+
+        z = numpy.dot(corners, self.dir)
+
+        x = numpy.dot(corners, self.right)
+        y = numpy.dot(corners, self.up)
+        hx = self.halfWidth * (1.0 + margin)
+        hy = self.halfHeight * (1.0 + margin)
+
+        if self.camType == "orthographic":
+            outside = (x > hx).all(axis=1) | (x < -hx).all(axis=1) | (y > hy).all(axis=1) | (y < -hy).all(axis=1)
+        else:
+            outside = (x > hx * z).all(axis=1) | (x < -hx * z).all(axis=1) | (y > hy * z).all(axis=1) | (y < -hy * z).all(axis=1)
+
+        outside |= (z < 0).all(axis=1)
+
+        return ~outside
+
+    def inCone(self, corners, margin):
+        # angular cameras see a cone around the view direction, an object is
+        # outside if its bounding sphere is, 'corners' relative to the camera
+        limit = self.coneAngle * (1.0 + margin)
+        if limit >= math.pi:
+            return numpy.ones(len(corners), dtype=bool)
+        centers, radii = boundingSpheres(corners)
+        distance = numpy.linalg.norm(centers, axis=1)
+        safeDistance = numpy.maximum(distance, 1e-10)
+        centerAngle = numpy.arccos(numpy.clip(numpy.dot(centers, self.dir) / safeDistance, -1.0, 1.0))
+        spread = numpy.arcsin(numpy.clip(radii / safeDistance, 0.0, 1.0))
+        # the camera inside the sphere sees it anyway
+        return (radii >= distance) | (centerAngle - spread <= limit)
+
+    def withinDistance(self, corners, distance):
+        # objects whose bounding sphere reaches closer to the camera than 'distance'
+        centers, radii = boundingSpheres(numpy.asarray(corners, dtype=numpy.float64))
+        return numpy.linalg.norm(centers - self.pos, axis=1) - radii < distance
@@ -25,6 +25,7 @@ from os.path import realpath, normpath
 class yafWorld:
     def __init__(self, interface):
         self.yi = interface
+        self.proxies = None
 
     def exportWorld(self, scene):
         yi = self.yi
@@ -65,6 +66,8 @@ class yafWorld:
                     image_file = abspath(worldTex.image.filepath)
                     image_file = realpath(image_file)
                     image_file = normpath(image_file)
+                    if self.proxies is not None and not worldTex.image.packed_file:
+                        image_file = self.proxies.getProxy(image_file)
 
                     yi.paramsSetString("filename", image_file)
 
@@ -20,7 +20,10 @@
 
 import bpy
 import mathutils
+from bpy.path import abspath
 from bpy.types import Operator
+from ..io import yaf_imagecache
+from ..io import yaf_proxy
 
 
 class OBJECT_OT_get_position(Operator):
@@ -210,6 +213,37 @@ class RENDER_OT_render_still(Operator):
             return {'FINISHED'}
 
 
+class RENDER_OT_texture_proxies(Operator):
+    bl_label = "Make texture proxies"
+    bl_idname = "render.yafaray_texture_proxies"
+    bl_description = "Make the downscaled copies of the image files used by previews and renders with texture proxies"
+
+    def execute(self, context):
+        scene = context.scene
+        sizes = {int(scene.gs_texture_proxy), int(scene.gs_preview_proxy)} - {0}
+        try:
+            directory = yaf_imagecache.cacheDirectory(scene.gs_image_cache_dir, "proxies")
+        except OSError as e:
+            self.report({'WARNING'}, ("Texture proxies not available: {0}".format(e)))
+            return {'CANCELLED'}
+
+        made = 0
+        for image in [i for i in bpy.data.images if i.users and i.source == 'FILE' and not i.packed_file]:
+            path = abspath(image.filepath, library=image.library)
+            for size in sorted(sizes):
+                try:
+                    if yaf_proxy.makeProxy(image, path, directory, size) is not None:
+                        made += 1
+                except (RuntimeError, OSError) as e:
+                    self.report({'WARNING'}, ("No proxy of {0}: {1}".format(image.name, e)))
+
+        # the proxies and the extracted images share the size limit of the cache
+        if made:
+            yaf_imagecache.evict(yaf_imagecache.cacheDirectory(scene.gs_image_cache_dir), scene.gs_image_cache_size * 1048576)
+        self.report({'INFO'}, ("{0:d} texture proxies ready".format(made)))
+        return {'FINISHED'}
+
+
 class YAF_OT_presets_ior_list(Operator):
     bl_idname = "material.set_ior_preset"
     bl_label = "IOR presets"
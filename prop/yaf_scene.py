@@ -167,6 +167,142 @@ def register():
         ),
         default='into_blender')
 
+    ########### YafaRays export optimization properties #############
+    Scene.gs_geometry_cache = BoolProperty(
+        name="Geometry cache",
+        description="Reuse the prepared geometry of unchanged objects on the following frames of an animation",
+        default=True)
+
+    Scene.gs_auto_instancing = BoolProperty(
+        name="Auto instancing",
+        description="Export meshes with identical content as instances of one base mesh",
+        default=False)
+
+    Scene.gs_persistent_session = BoolProperty(
+        name="Persistent session",
+        description="Keep the scene alive between the frames of an animation and only export what changed",
+        default=False)
+
+    Scene.gs_incremental_export = BoolProperty(
+        name="Incremental export",
+        description="Keep the scene alive between still renders and only export what changed since the last render",
+        default=False)
+
+    Scene.gs_preview_session = BoolProperty(
+        name="Warm previews",
+        description="Keep the preview scene loaded between material and texture previews and only export what changed",
+        default=True)
+
+    Scene.gs_memory_output = BoolProperty(
+        name="Memory output",
+        description="Pass the rendered image to Blender from memory and write the output file in the background (PNG, TGA and HDR without Z-buffer)",
+        default=False)
+
+    Scene.gs_export_stats = BoolProperty(
+        name="Export statistics",
+        description="Time the export phases, count the interface calls and write a JSON report per frame next to the rendered images",
+        default=False)
+
+    Scene.gs_cull_geometry = BoolProperty(
+        name="Frustum culling",
+        description="Don't export geometry outside of the camera view",
+        default=False)
+
+    Scene.gs_cull_margin = FloatProperty(
+        name="Margin",
+        description="Widen the camera view used for culling, relative to the frame size",
+        min=0.0, max=10.0,
+        default=0.1)
+
+    Scene.gs_cull_keep_distance = FloatProperty(
+        name="Keep casters within",
+        description="Keep geometry closer to the camera than this distance, as it may cast shadows or bounce light into view (0 = disabled)",
+        min=0.0,
+        default=10.0)
+
+    Scene.gs_lod = BoolProperty(
+        name="Level of detail",
+        description="Merge vertices of objects that are small on screen, the objects and their data are not changed",
+        default=False)
+
+    Scene.gs_lod_pixels = FloatProperty(
+        name="Full detail pixels",
+        description="Objects smaller on screen than this size in pixels get less detail, one level for every halving of the size",
+        min=1.0, max=10000.0,
+        default=256.0)
+
+    Scene.gs_lod_levels = IntProperty(
+        name="Levels",
+        description="Maximum number of detail levels to reduce",
+        min=1, max=8,
+        default=3)
+
+    Scene.gs_image_cache = BoolProperty(
+        name="Image cache",
+        description="Extract packed and generated images once into a local cache directory instead of saving them next to the .blend file on every render",
+        default=False)
+
+    Scene.gs_image_cache_dir = StringProperty(
+        name="Cache directory",
+        description="Directory of the image cache, empty for a folder in the temporary directory",
+        subtype='DIR_PATH',
+        default="")
+
+    Scene.gs_image_cache_size = IntProperty(
+        name="Cache size (MB)",
+        description="The least recently used images are removed from the cache above this size",
+        min=16, max=1048576,
+        default=4096)
+
+    Scene.gs_texture_proxy = EnumProperty(
+        name="Texture proxies",
+        description="Maximum size of the image textures of renders, larger images are replaced by cached downscaled copies",
+        items=(
+            ('0', "Original", "Use the original images"),
+            ('256', "256", "Scale images down to at most 256 pixels"),
+            ('512', "512", "Scale images down to at most 512 pixels"),
+            ('1024', "1024", "Scale images down to at most 1024 pixels"),
+            ('2048', "2048", "Scale images down to at most 2048 pixels"),
+            ('4096', "4096", "Scale images down to at most 4096 pixels")
+        ),
+        default='0')
+
+    Scene.gs_preview_proxy = EnumProperty(
+        name="Preview proxies",
+        description="Maximum size of the image textures of material previews and clay renders",
+        items=(
+            ('0', "Original", "Use the original images"),
+            ('256', "256", "Scale images down to at most 256 pixels"),
+            ('512', "512", "Scale images down to at most 512 pixels"),
+            ('1024', "1024", "Scale images down to at most 1024 pixels"),
+            ('2048', "2048", "Scale images down to at most 2048 pixels"),
+            ('4096', "4096", "Scale images down to at most 4096 pixels")
+        ),
+        default='0')
+
+    Scene.gs_hair_lod = BoolProperty(
+        name="Hair level of detail",
+        description="Thin out and simplify hair strands that are small on screen",
+        default=False)
+
+    Scene.gs_hair_lod_pixels = FloatProperty(
+        name="Strand pixels",
+        description="Strands shorter than this size on screen (in pixels) get thinned out",
+        min=0.1, max=1000.0,
+        default=8.0)
+
+    Scene.gs_hair_lod_min_density = FloatProperty(
+        name="Min. density",
+        description="Minimal fraction of strands kept, root and tip size are scaled up to keep the coverage",
+        min=0.01, max=1.0,
+        default=0.1)
+
+    Scene.gs_hair_lod_curvature = FloatProperty(
+        name="Curvature tolerance",
+        description="Drop hair keys while the strand bends less than this angle (in degrees), 0 keeps all keys",
+        min=0.0, max=45.0,
+        default=2.0)
+
     ######### YafaRays own image output property ############
     Scene.img_output = EnumProperty(
         name="Image File Type",
@@ -529,6 +665,29 @@ def unregister():
     Scene.gs_verbose
     Scene.gs_type_render
 
+    Scene.gs_geometry_cache
+    Scene.gs_auto_instancing
+    Scene.gs_persistent_session
+    Scene.gs_incremental_export
+    Scene.gs_preview_session
+    Scene.gs_memory_output
+    Scene.gs_export_stats
+    Scene.gs_cull_geometry
+    Scene.gs_cull_margin
+    Scene.gs_cull_keep_distance
+    Scene.gs_lod
+    Scene.gs_lod_pixels
+    Scene.gs_lod_levels
+    Scene.gs_image_cache
+    Scene.gs_image_cache_dir
+    Scene.gs_image_cache_size
+    Scene.gs_texture_proxy
+    Scene.gs_preview_proxy
+    Scene.gs_hair_lod
+    Scene.gs_hair_lod_pixels
+    Scene.gs_hair_lod_min_density
+    Scene.gs_hair_lod_curvature
+
     Scene.img_output
 
     Scene.intg_light_method
@@ -0,0 +1,109 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import bpy
+from bpy.types import Panel
+from bl_ui.properties_render import RenderButtonsPanel
+
+RenderButtonsPanel.COMPAT_ENGINES = {'YAFA_RENDER'}
+
+
+class YAF_PT_export_settings(RenderButtonsPanel, Panel):
+    bl_label = "Export Settings"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+
+        scene = context.scene
+        layout = self.layout
+
+        split = layout.split()
+        col = split.column()
+        col.prop(scene, "gs_geometry_cache")
+
+        col = split.column()
+        col.prop(scene, "gs_auto_instancing")
+
+        split = layout.split()
+        col = split.column()
+        col.prop(scene, "gs_persistent_session")
+        sub = col.column()
+        sub.active = scene.gs_type_render == "file" and not scene.gs_z_channel
+        sub.prop(scene, "gs_memory_output")
+
+        col = split.column()
+        col.prop(scene, "gs_incremental_export")
+        col.prop(scene, "gs_preview_session")
+        col.prop(scene, "gs_export_stats")
+
+        layout.separator()
+
+        layout.prop(scene, "gs_cull_geometry")
+        split = layout.split()
+        split.active = scene.gs_cull_geometry
+        col = split.column()
+        col.prop(scene, "gs_cull_margin")
+        col = split.column()
+        col.prop(scene, "gs_cull_keep_distance")
+
+        layout.separator()
+
+        layout.prop(scene, "gs_lod")
+        split = layout.split()
+        split.active = scene.gs_lod
+        col = split.column()
+        col.prop(scene, "gs_lod_pixels")
+        col = split.column()
+        col.prop(scene, "gs_lod_levels")
+
+        layout.separator()
+
+        layout.prop(scene, "gs_image_cache")
+        split = layout.split()
+        split.active = scene.gs_image_cache
+        col = split.column()
+        col.prop(scene, "gs_image_cache_dir")
+        col = split.column()
+        col.prop(scene, "gs_image_cache_size")
+
+        layout.separator()
+
+        split = layout.split()
+        col = split.column()
+        col.prop(scene, "gs_texture_proxy")
+        col = split.column()
+        col.prop(scene, "gs_preview_proxy")
+        layout.operator("render.yafaray_texture_proxies")
+
+        layout.separator()
+
+        layout.prop(scene, "gs_hair_lod")
+        split = layout.split()
+        split.active = scene.gs_hair_lod
+        col = split.column()
+        col.prop(scene, "gs_hair_lod_pixels")
+        col.prop(scene, "gs_hair_lod_min_density")
+        col = split.column()
+        col.prop(scene, "gs_hair_lod_curvature")
+
+
+if __name__ == "__main__":  # only for live edit.
+    import bpy
+    bpy.utils.register_module(__name__)
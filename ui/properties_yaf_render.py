@@ -117,6 +117,7 @@ class YAFRENDER_PT_dimensions(RenderButtonsPanel, Panel):
 from . import properties_yaf_general_settings
 from . import properties_yaf_integrator
 from . import properties_yaf_AA_settings
+from . import properties_yaf_export_settings
 
 
 class YAFRENDER_PT_output(RenderButtonsPanel, Panel):